@@ -1,9 +1,15 @@
 import os
 import abc
 import collections
+import datetime
+import json
+import platform
 import random
 import re
+import statistics
+import subprocess
 import sys
+import tracemalloc
 
 import itertools
 import timeit
@@ -95,16 +101,8 @@ class ITreeProxy(IntervalContainerProxy):
         return [tuple(iv) for iv in intervals]
 
     @classmethod
-    def contents(cls, t: T):
-        """currently not implemented in itree."""
-        s = [t.root]
-        result = set()
-        while len(s):
-            n = s.pop()
-            children = [c for c in n.c if c is not None]
-            result.update(children)
-            s += children
-        return result
+    def contents(cls, t: itree.ITree):
+        return set((iv.start, iv.end) for iv in t)
 
     def constructor(self, intervals) -> Callable[[], itree.ITree]:
         self._object = itree.ITree(intervals)
@@ -178,7 +176,12 @@ class NaiveProxy(IntervalContainerProxy):
 
     def remover(self, intervals):
         self._object = self.construct()
-        return lambda: [dbi for dbi in self._object if dbi not in intervals]
+
+        def remove():
+            for i in intervals:
+                if i in self._object:
+                    self._object.remove(i)
+        return remove
 
 
 class Benchmarker(Generic[T, S]):
@@ -222,7 +225,7 @@ class Benchmarker(Generic[T, S]):
     def validate_state(self, label, acquired, expected):
         self.validate_sets(label,
                            self.proxy.contents(self.proxy.object),
-                           self.proxy.contents(self.proxy.object))
+                           self.validator.contents(self.validator.object))
 
     def validate_results(self, label, acquired, expected):
         self.validate_sets(label,
@@ -297,7 +300,17 @@ def do_bench(proxy_cls, validator_cls, insert_intervals, search_intervals,
         ) for r in rs))
 
 
-@click.command()
+def read_bed_intervals(bed_file: str) -> List[IV]:
+    with open(bed_file) as f:
+        return [tuple(int(x) for x in l.split()[1:3]) for l in f]
+
+
+@click.group()
+def cli():
+    """Benchmark itree and other interval containers."""
+
+
+@cli.command()
 @click.option('--search-frac', type=float, show_default=True, default=.5,
               help="Sample this fraction of intervals for benchmarking search")
 @click.option('--remove-frac', type=float, show_default=True, default=.5,
@@ -307,12 +320,12 @@ def do_bench(proxy_cls, validator_cls, insert_intervals, search_intervals,
 @click.argument('MIN_TREE_SIZE', type=int)
 @click.argument('MAX_TREE_SIZE', type=int)
 @click.argument('STEP_SIZE', type=int)
-def main(seed, bed_file, search_frac, remove_frac, min_tree_size, max_tree_size,
-         step_size):
+def compare(seed, bed_file, search_frac, remove_frac, min_tree_size,
+            max_tree_size, step_size):
+    """Compare insert, remove and search across implementations."""
     random.seed(seed)
 
-    with open(bed_file) as f:
-        ivs = [tuple(int(x) for x in l.split()[1:3]) for l in f]
+    ivs = read_bed_intervals(bed_file)
 
     for s in range(min_tree_size, max_tree_size+1, step_size):
         insert_ivs = random.sample(ivs, s)
@@ -323,5 +336,543 @@ def main(seed, bed_file, search_frac, remove_frac, min_tree_size, max_tree_size,
             do_bench(proxy, NaiveProxy, insert_ivs, search_ivs, remove_ivs)
 
 
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=12)
+@click.argument('BED_FILE')
+@click.argument('NUM_POSITIONS', type=int)
+def points(seed, repeat, bed_file, num_positions):
+    """Compare point queries via search, search_point and search_points.
+
+    NUM_POSITIONS positions are drawn uniformly from the span of the
+    intervals in BED_FILE.
+    """
+    random.seed(seed)
+
+    ivs = ITreeProxy.encode_intervals(read_bed_intervals(bed_file))
+    tree = itree.ITree.from_intervals(ivs)
+    lo, hi = min(iv.start for iv in ivs), max(iv.end for iv in ivs)
+    positions = [random.randint(lo, hi) for _ in range(num_positions)]
+
+    methods = {
+        'search': lambda: [tree.search(NamedIV(p, p)) for p in positions],
+        'search_point': lambda: [tree.search_point(p) for p in positions],
+        'search_points': lambda: tree.search_points(positions),
+    }
+    for op, method in methods.items():
+        for _ in range(repeat):
+            r = timeit.timeit(method, number=1)
+            print('\t'.join(
+                str(x) for x in ['itree', len(tree), num_positions, op, r]))
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.option('--max-workers', type=int, show_default=True,
+              default=os.cpu_count())
+@click.argument('BED_FILE')
+@click.argument('NUM_QUERIES', type=int)
+def parallel(seed, repeat, max_workers, bed_file, num_queries):
+    """Measure the scaling of GroupedITree.search_many across processes.
+
+    NUM_QUERIES intervals sampled with replacement from BED_FILE are
+    searched with 1, 2, 4, ... up to --max-workers processes.
+    """
+    random.seed(seed)
+
+    tree = itree.GroupedITree.from_bed(bed_file)
+    records = list(itertools.chain.from_iterable(tree.trees.values()))
+    queries = random.choices(records, k=num_queries)
+
+    workers = 1
+    while workers <= max_workers:
+        # the first call writes the shared index, so warm up untimed
+        tree.search_many(queries[:1], workers=workers)
+        for _ in range(repeat):
+            r = timeit.timeit(
+                lambda: tree.search_many(queries, workers=workers), number=1)
+            print('\t'.join(str(x) for x in [
+                'itree', len(records), num_queries, f'search_many_{workers}',
+                r]))
+        workers *= 2
+
+
+def gil_enabled() -> bool:
+    # sys._is_gil_enabled is only defined from Python 3.13
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled() if is_gil_enabled is not None else True
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.option('--max-threads', type=int, show_default=True,
+              default=os.cpu_count())
+@click.argument('BED_FILE')
+@click.argument('NUM_QUERIES', type=int)
+def threads(seed, repeat, max_threads, bed_file, num_queries):
+    """Measure the scaling of search_many across threads.
+
+    NUM_QUERIES intervals sampled with replacement from BED_FILE are
+    searched with 1, 2, 4, ... up to --max-threads threads, both by
+    GroupedITree.search_many and by ITree.search_many on the largest group.
+    The last column records whether the global interpreter lock is enabled:
+    threads only scale on a free-threaded build, so run the command under
+    both builds (e.g. python3.13 and python3.13t) to compare them.
+    """
+    random.seed(seed)
+
+    tree = itree.GroupedITree.from_bed(bed_file)
+    records = list(itertools.chain.from_iterable(tree.trees.values()))
+    queries = random.choices(records, k=num_queries)
+    largest = max(tree.trees.values(), key=len)
+    starts = [q.start for q in queries]
+    ends = [q.end for q in queries]
+    gil = 'gil' if gil_enabled() else 'nogil'
+
+    n = 1
+    while n <= max_threads:
+        for _ in range(repeat):
+            grouped = timeit.timeit(
+                lambda: tree.search_many(queries, threads=n), number=1)
+            single = timeit.timeit(
+                lambda: largest.search_many(starts, ends, threads=n),
+                number=1)
+            for method, r in [(f'grouped_search_many_{n}', grouped),
+                              (f'search_many_{n}', single)]:
+                print('\t'.join(str(x) for x in [
+                    'itree', len(records), num_queries, method, r, gil]))
+        n *= 2
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.option('--fractions', show_default=True,
+              default='0.001,0.005,0.01,0.02,0.05,0.1,0.2,0.5',
+              help="Comma separated fractions of the tree to mutate")
+@click.argument('BED_FILE')
+def batch(seed, repeat, fractions, bed_file):
+    """Find the crossover of insert_many and remove_many strategies.
+
+    For each fraction, that fraction of the intervals in BED_FILE is
+    inserted into or removed from a tree of the rest one at a time
+    ("single"), by rebuilding the tree ("rebuild") and by letting the tree
+    choose ("auto").
+    """
+    random.seed(seed)
+
+    ivs = ITreeProxy.encode_intervals(read_bed_intervals(bed_file))
+    strategies = {
+        'single': lambda k: False,
+        'rebuild': lambda k: True,
+        'auto': None,
+    }
+    for frac in (float(f) for f in fractions.split(',')):
+        batch_ivs = random.sample(ivs, int(len(ivs) * frac))
+        batch_ids = set(map(id, batch_ivs))
+        rest_ivs = [iv for iv in ivs if id(iv) not in batch_ids]
+        for name, strategy in strategies.items():
+            for op in ['insert_many', 'remove_many']:
+                for _ in range(repeat):
+                    tree = itree.ITree.from_intervals(
+                        rest_ivs if op == 'insert_many' else ivs)
+                    if strategy is not None:
+                        tree._rebuild_is_cheaper = strategy
+                    method = getattr(tree, op)
+                    r = timeit.timeit(lambda: method(batch_ivs), number=1)
+                    print('\t'.join(str(x) for x in [
+                        'itree', len(ivs), len(batch_ivs), f'{op}_{name}',
+                        r]))
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.option('--bursts', type=int, show_default=True, default=20)
+@click.option('--queries', 'num_queries', type=int, show_default=True,
+              default=1000, help="Searches after each burst of insertions")
+@click.argument('BED_FILE')
+def lsm(seed, repeat, bursts, num_queries, bed_file):
+    """Compare ITree and LSMITree on bursts of insertions.
+
+    Half of the intervals in BED_FILE are built into a tree and the other
+    half are inserted one at a time in --bursts bursts, each followed by
+    --queries searches for sampled intervals. The time spent inserting and
+    searching is printed for each kind of tree.
+    """
+    random.seed(seed)
+
+    ivs = ITreeProxy.encode_intervals(read_bed_intervals(bed_file))
+    random.shuffle(ivs)
+    initial, inserted = ivs[:len(ivs) // 2], ivs[len(ivs) // 2:]
+    size = -(-len(inserted) // bursts)
+    queries = [random.choices(ivs, k=num_queries) for _ in range(bursts)]
+    trees = {
+        'itree': lambda: itree.ITree.from_intervals(initial),
+        'lsm': lambda: itree.LSMITree(initial),
+        'lsm_background': lambda: itree.LSMITree(initial, background=True),
+    }
+    for name, make_tree in trees.items():
+        for _ in range(repeat):
+            tree = make_tree()
+            insert_time = search_time = 0.
+            for k in range(bursts):
+                burst = inserted[k * size:(k + 1) * size]
+                t0 = timeit.default_timer()
+                for iv in burst:
+                    tree.insert(iv)
+                t1 = timeit.default_timer()
+                for q in queries[k]:
+                    tree.search(q)
+                insert_time += t1 - t0
+                search_time += timeit.default_timer() - t1
+            for op, r in [('insert', insert_time), ('search', search_time)]:
+                print('\t'.join(str(x) for x in [
+                    name, len(ivs), len(inserted), op, r]))
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.option('--width', type=int, show_default=True, default=100000,
+              help="Width of the windows searched for contained intervals")
+@click.argument('BED_FILE')
+@click.argument('NUM_QUERIES', type=int)
+def containment(seed, repeat, width, bed_file, num_queries):
+    """Compare containment queries with filtering the results of search.
+
+    NUM_QUERIES windows of --width bases starting at sampled intervals of
+    BED_FILE are searched for the intervals within them, and the sampled
+    intervals themselves for the intervals enclosing them.
+    """
+    random.seed(seed)
+
+    ivs = ITreeProxy.encode_intervals(read_bed_intervals(bed_file))
+    tree = itree.ITree.from_intervals(ivs)
+    samples = random.choices(ivs, k=num_queries)
+    windows = [itree.Interval(iv.start, iv.start + width) for iv in samples]
+
+    def filtered_within():
+        for q in windows:
+            [i for i in tree.search(q)
+             if q.start <= i.start and i.end <= q.end]
+
+    def filtered_enclosing():
+        for q in samples:
+            [i for i in tree.search(q)
+             if i.start <= q.start and q.end <= i.end]
+
+    methods = {
+        'search_within': lambda: [tree.search_within(q) for q in windows],
+        'filtered_within': filtered_within,
+        'search_enclosing':
+            lambda: [tree.search_enclosing(q) for q in samples],
+        'filtered_enclosing': filtered_enclosing,
+    }
+    for name, method in methods.items():
+        for _ in range(repeat):
+            r = timeit.timeit(method, number=1)
+            print('\t'.join(str(x) for x in [
+                'itree', len(ivs), num_queries, name, r]))
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.argument('BED_FILE')
+@click.argument('NUM_QUERIES', type=int)
+def buckets(seed, repeat, bed_file, num_queries):
+    """Compare trees with and without duplicate buckets.
+
+    Prints the number of nodes of each tree and the time taken to search
+    for NUM_QUERIES intervals sampled from BED_FILE.
+    """
+    random.seed(seed)
+
+    ivs = ITreeProxy.encode_intervals(read_bed_intervals(bed_file))
+    queries = random.choices(ivs, k=num_queries)
+    for use_buckets in [False, True]:
+        tree = itree.ITree.from_intervals(ivs, buckets=use_buckets)
+        op = 'search_buckets' if use_buckets else 'search'
+        nodes = sum(1 for _ in tree._nodes())
+        for _ in range(repeat):
+            r = timeit.timeit(lambda: [tree.search(q) for q in queries],
+                              number=1)
+            print('\t'.join(str(x) for x in [
+                'itree', len(tree), num_queries, op, nodes, r]))
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--width', type=int, show_default=True, default=10000,
+              help="The largest width of the random queries")
+@click.argument('BED_FILE')
+@click.argument('NUM_QUERIES', type=int)
+def stats(seed, width, bed_file, num_queries):
+    """Report the search statistics of a tree built from BED_FILE.
+
+    NUM_QUERIES random intervals of up to --width are searched with
+    statistics enabled.
+    """
+    random.seed(seed)
+
+    tree = itree.GroupedITree.from_bed(bed_file)
+    tree.enable_stats()
+    records = list(itertools.chain.from_iterable(tree.trees.values()))
+    lo, hi = min(r.start for r in records), max(r.end for r in records)
+    for _ in range(num_queries):
+        chrom = random.choice(records).chrom
+        start = random.randint(lo, hi)
+        tree.search(itree.BedInterval(chrom, start,
+                                      start + random.randint(0, width)))
+
+    total = sum(tree.stats.values(), itree.TreeStats())
+    for name in itree.TreeStats.__slots__:
+        print(f'{name}\t{getattr(total, name)}')
+    print(f'visited_per_search\t{total.visited / total.searches}')
+    print(f'visited_per_hit\t{total.visited_per_hit}')
+
+
+def synthetic_intervals(n: int, length: int, density: float,
+                        rng: random.Random) -> List[IV]:
+    """Generate random intervals.
+
+    Lengths are uniform between 1 and twice ``length`` and starts are
+    uniform over a span chosen so that on average ``density`` intervals
+    overlap each position.
+    """
+    span = max(1, int(n * length / density))
+    ivs = []
+    for _ in range(n):
+        start = rng.randrange(span)
+        ivs.append((start, start + rng.randrange(1, 2 * length)))
+    return ivs
+
+
+def tiled_bed_intervals(bed_ivs: List[IV], n: int,
+                        rng: random.Random) -> List[IV]:
+    """Sample n intervals from copies of a BED file's intervals.
+
+    Each copy is shifted past the end of the previous one, so trees larger
+    than the file keep its lengths and overlap density.
+    """
+    if n <= len(bed_ivs):
+        return rng.sample(bed_ivs, n)
+    span = max(end for _, end in bed_ivs) + 1
+    copies = -(-n // len(bed_ivs))
+    return rng.sample([(start + k * span, end + k * span)
+                       for k in range(copies) for start, end in bed_ivs], n)
+
+
+def query_intervals(ivs: List[IV], num_queries: int,
+                    rng: random.Random) -> List[IV]:
+    """Draw queries like the intervals of a workload.
+
+    Each query is one of the intervals shifted by up to its own length.
+    """
+    queries = []
+    for start, end in rng.choices(ivs, k=num_queries):
+        shift = rng.randint(start - end, end - start)
+        queries.append((start + shift, end + shift))
+    return queries
+
+
+def peak_rss() -> Optional[int]:
+    """The peak resident set size of the process in bytes, if known"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def time_operation(method: Callable[[], object], repeat: int) -> dict:
+    times = [timeit.timeit(method, number=1) for _ in range(repeat)]
+    return {'times': times, 'min': min(times),
+            'median': statistics.median(times)}
+
+
+def bench_workload(ivs: List[IV], queries: List[IV], positions: List[int],
+                   repeat: int, trace: bool) -> dict:
+    """Time each operation on a tree of ``ivs``.
+
+    :return: a dictionary of the results of each operation
+    """
+    ivs = ITreeProxy.encode_intervals(ivs)
+    queries = ITreeProxy.encode_intervals(queries)
+    starts, ends = [q.start for q in queries], [q.end for q in queries]
+    results = {}
+
+    if trace:
+        # tracing slows allocation down, so it gets a build of its own
+        tracemalloc.start()
+        tree = itree.ITree.from_intervals(ivs)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del tree
+    results['build'] = time_operation(
+        lambda: itree.ITree.from_intervals(ivs), repeat)
+    if trace:
+        results['build'].update(tracemalloc_size=size,
+                                tracemalloc_peak=peak)
+
+    tree = itree.ITree.from_intervals(ivs)
+    query_tree = itree.ITree.from_intervals(queries)
+    frozen = itree.FrozenITree(tree)
+    tree.count_many(starts[:1], ends[:1])
+    operations = {
+        'point': lambda: tree.search_points(positions),
+        'range': lambda: [tree.search(q) for q in queries],
+        'batch': lambda: tree.search_many(starts, ends),
+        'count': lambda: tree.count_many(starts, ends),
+        'join': lambda: sum(1 for _ in tree.join(query_tree)),
+        'frozen_batch': lambda: frozen.search_many(starts, ends),
+    }
+    for op, method in operations.items():
+        results[op] = time_operation(method, repeat)
+
+    # removing the inserted queries restores the tree for the next repeat
+    insert_times, remove_times = [], []
+    for _ in range(repeat):
+        insert_times.append(timeit.timeit(
+            lambda: [tree.insert(q) for q in queries], number=1))
+        remove_times.append(timeit.timeit(
+            lambda: [tree.remove(q) for q in queries], number=1))
+    for op, times in [('insert', insert_times), ('remove', remove_times)]:
+        results[op] = {'times': times, 'min': min(times),
+                       'median': statistics.median(times)}
+
+    return results
+
+
+def run_metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'itree_version': itree.__version__,
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'gil': gil_enabled(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+@cli.command()
+@click.option('--seed', type=int, show_default=True, default=121080)
+@click.option('--repeat', type=int, show_default=True, default=3)
+@click.option('--sizes', show_default=True, default='1e3,1e4,1e5,1e6',
+              help="Comma separated tree sizes (up to 1e7)")
+@click.option('--lengths', show_default=True, default='1000',
+              help="Comma separated mean lengths of synthetic intervals")
+@click.option('--densities', show_default=True, default='1,10',
+              help="Comma separated mean numbers of synthetic intervals "
+                   "overlapping each position")
+@click.option('--bed', 'bed_file', default=None,
+              help="Also run a workload sampled from this BED file")
+@click.option('--queries', 'num_queries', type=int, show_default=True,
+              default=10000, help="The number of queries per operation")
+@click.option('--tracemalloc/--no-tracemalloc', 'trace', default=True,
+              show_default=True,
+              help="Measure the memory allocated by each build")
+@click.option('--output', type=click.File('w'), default='-',
+              help="Write the JSON results to this file")
+def suite(seed, repeat, sizes, lengths, densities, bed_file, num_queries,
+          trace, output):
+    """Run the benchmark suite and write the results as JSON.
+
+    Every workload is a tree of synthetic or BED-derived intervals. For each
+    one, the build, insert, remove, point, range, batch, count, join and
+    frozen_batch operations are timed --repeat times. The results can be
+    compared with a later run with the regressions command.
+    """
+    workloads = []
+    for size in (int(float(x)) for x in sizes.split(',')):
+        for length in (int(x) for x in lengths.split(',')):
+            for density in (float(x) for x in densities.split(',')):
+                workloads.append(({'workload': 'synthetic', 'size': size,
+                                   'length': length, 'density': density},
+                                  lambda rng, n=size, l=length, d=density:
+                                  synthetic_intervals(n, l, d, rng)))
+        if bed_file is not None:
+            bed_ivs = read_bed_intervals(bed_file)
+            workloads.append(({'workload': os.path.basename(bed_file),
+                               'size': size},
+                              lambda rng, n=size:
+                              tiled_bed_intervals(bed_ivs, n, rng)))
+
+    records = []
+    for params, generate in workloads:
+        rng = random.Random(seed)
+        ivs = generate(rng)
+        queries = query_intervals(ivs, num_queries, rng)
+        lo, hi = min(s for s, _ in ivs), max(e for _, e in ivs)
+        positions = [rng.randint(lo, hi) for _ in range(num_queries)]
+
+        results = bench_workload(ivs, queries, positions, repeat, trace)
+        # the peak so far, which is usually reached by the largest tree
+        results['build']['peak_rss'] = peak_rss()
+        for op, result in results.items():
+            records.append(dict(params, operation=op, queries=num_queries,
+                                **result))
+        click.echo(f"{params}: build {results['build']['min']:.3f}s, "
+                   f"range {results['range']['min']:.3f}s", err=True)
+        del ivs, results
+
+    json.dump({'metadata': run_metadata(), 'records': records}, output,
+              indent=1)
+    output.write('\n')
+
+
+RECORD_KEY = ('workload', 'size', 'length', 'density', 'queries',
+              'operation')
+
+
+def record_key(record: dict) -> tuple:
+    return tuple(record.get(k) for k in RECORD_KEY)
+
+
+@cli.command()
+@click.option('--threshold', type=float, show_default=True, default=0.1,
+              help="Flag slowdowns or memory increases beyond this fraction")
+@click.argument('BASELINE', type=click.File())
+@click.argument('CURRENT', type=click.File())
+def regressions(threshold, baseline, current):
+    """Compare two suite runs and flag regressions.
+
+    The fastest time of each operation (and the traced memory of each build)
+    in CURRENT is compared with BASELINE. Exits with status 1 if anything
+    regressed by more than --threshold.
+    """
+    before = {record_key(r): r for r in json.load(baseline)['records']}
+    regressed = False
+    for record in json.load(current)['records']:
+        old = before.get(record_key(record))
+        if old is None:
+            continue
+        for metric in ('min', 'tracemalloc_peak'):
+            if record.get(metric) is None or not old.get(metric):
+                continue
+            ratio = record[metric] / old[metric]
+            flag = ratio > 1 + threshold
+            regressed |= flag
+            label = ' '.join(str(v) for v in record_key(record)
+                             if v is not None)
+            click.echo('\t'.join([label, metric, f'{old[metric]:.6g}',
+                                   f'{record[metric]:.6g}', f'{ratio:.3f}',
+                                   'REGRESSION' if flag else 'ok']))
+    sys.exit(1 if regressed else 0)
+
+
 if __name__ == '__main__':
-    main()
+    cli()
@@ -1,3 +1,7 @@
 from .itree import ITree, ITreeNode, GroupedITree
+from .frozen import FrozenITree, Interval
+from .bed import BedInterval, read_bed
+from .lsm import LSMITree
+from .stats import TreeStats
 
 __version__ = '0.0.5'
@@ -0,0 +1,89 @@
+"""
+Streaming reader for BED files.
+"""
+import mmap as _mmap
+import sys
+from typing import Iterator, Optional
+
+
+class BedInterval(object):
+    """A lightweight interval record read from a BED file.
+
+    Only the chromosome, the coordinates and the name (if present) are
+    kept. Chromosome names are interned so that all the records of a
+    chromosome share one string.
+    """
+
+    __slots__ = ('chrom', 'start', 'end', 'name')
+
+    def __init__(self, chrom: str, start: int, end: int,
+                 name: Optional[str] = None):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, BedInterval) and \
+            (self.chrom, self.start, self.end, self.name) == \
+            (other.chrom, other.start, other.end, other.name)
+
+    def __hash__(self):
+        return hash((self.chrom, self.start, self.end, self.name))
+
+    def __repr__(self):
+        return f"BedInterval({self.chrom!r},{self.start},{self.end}" + \
+               (f",{self.name!r})" if self.name is not None else ")")
+
+
+def read_bed(path: str, mmap: bool = False,
+             chunk_size: int = 1 << 20) -> Iterator[BedInterval]:
+    """Iterate over the records of a BED file.
+
+    The file is read in binary chunks of ``chunk_size`` bytes rather than
+    being loaded at once. Empty lines, comments and ``track`` or ``browser``
+    lines are skipped. Fields may be separated by tabs or spaces.
+
+    :param path: the path of the BED file
+    :param mmap: map the file into memory instead of reading it
+    :param chunk_size: the number of bytes to parse at a time
+    :return: an iterator of ``BedInterval`` records
+    """
+    chroms = {}
+    for line in _read_lines(path, mmap, chunk_size):
+        if line.startswith((b'#', b'track', b'browser')):
+            continue
+        fields = line.split(None, 4)
+        if not fields:
+            continue
+        chrom = chroms.get(fields[0])
+        if chrom is None:
+            chrom = chroms[fields[0]] = sys.intern(fields[0].decode())
+        name = fields[3].decode() if len(fields) > 3 else None
+        yield BedInterval(chrom, int(fields[1]), int(fields[2]), name)
+
+
+def _read_lines(path: str, mmap: bool, chunk_size: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        if mmap:
+            try:
+                source = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                return
+        else:
+            source = f
+
+        # lines may straddle chunks, so the incomplete tail of each chunk is
+        # carried over to the next
+        with source:
+            tail = b''
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                lines = (tail + chunk).split(b'\n')
+                tail = lines.pop()
+                yield from lines
+            if tail:
+                yield tail
@@ -0,0 +1,594 @@
+"""
+Immutable, array-backed interval tree for read-heavy workloads.
+"""
+import collections
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heapify, heappop, heappush
+from typing import List, Optional
+
+from .storage import read_index, write_index
+
+"""
+
+A ``FrozenITree`` holds the same information as an ``ITree`` but without any
+per-interval Python objects. The intervals are sorted by start and their
+coordinates stored in contiguous typed arrays. The tree is implicit in this
+layout: the node covering the index range [lo, hi) sits at the midpoint
+mid = (lo + hi) // 2, its left subtree covers [lo, mid) and its right subtree
+covers [mid + 1, hi). As in ``ITree``, the minimum and maximum coordinate of
+each subtree are stored with its root so that searches only explore subtrees
+which may overlap the query:
+
+    index      0      1      2      3      4      5      6
+    start      5      8     15     16     17     25     26
+    end        8      9     23     21     19     30     26
+    min        5      5     15      5     17     17     26
+    max        8     23     23     30     19     30     26
+
+Here index 3 is the root covering [0, 7), index 1 the root of [0, 3) and
+index 5 the root of [4, 7).
+
+The original objects are kept in ``intervals`` and each array position
+records the index of its object in a separate ``index`` array, so a search
+returns the same objects that the tree was built with.
+"""
+
+
+#: The record type returned by trees loaded without their interval objects
+Interval = collections.namedtuple('Interval', ['start', 'end'])
+
+
+class FrozenITree(object):
+    """Immutable interval tree stored in typed arrays.
+
+    The tree may be built from an ``ITree`` or any iterable of objects with
+    integer ``start`` and ``end`` properties or attributes. It cannot be
+    modified after construction, but its queries return the same results
+    as those of ``ITree`` while using a fraction of the memory.
+    """
+
+    def __init__(self, intervals=None):
+        """Initialize a frozen interval tree.
+
+        :param intervals: an ``ITree`` or an iterable of interval objects.
+        """
+        self.intervals = list(intervals) if intervals is not None else []
+        order = sorted(range(len(self.intervals)),
+                       key=lambda k: self.intervals[k].start)
+
+        self.index = array('q', order)
+        self.starts = array('q', (self.intervals[k].start for k in order))
+        self.ends = array('q', (self.intervals[k].end for k in order))
+        self.mins = array('q', map(min, self.starts, self.ends))
+        self.maxs = array('q', map(max, self.starts, self.ends))
+        self._sorted_ends = None
+        self._augment()
+
+    @classmethod
+    def _from_columns(cls, starts, ends, mins, maxs, index, intervals=None):
+        # Wrap existing columns, e.g. those of a loaded index, without
+        # copying them.
+        tree = cls.__new__(cls)
+        tree.starts, tree.ends = starts, ends
+        tree.mins, tree.maxs = mins, maxs
+        tree.index = index
+        tree.intervals = intervals if intervals is not None else \
+            _StoredIntervals(starts, ends)
+        tree._sorted_ends = None
+        return tree
+
+    def save(self, path: str, payload: bool = True):
+        """Save the tree to a binary index file.
+
+        :param path: the path of the file to write
+        :param payload: also store the interval objects (by pickling them).
+            Otherwise, a loaded tree returns ``Interval`` records holding
+            only the coordinates. Files to be shared with others should be
+            saved without the payload, see ``load``.
+        """
+        write_index(path, [self], payload=payload)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """Load a tree saved with ``save``.
+
+        The interval objects of a file saved with its payload are
+        unpickled, which can run arbitrary code. Only load such files from
+        trusted sources.
+
+        :param path: the path of the file to read
+        :param mmap: map the file into memory so that the columns are
+            used in place and shared between processes, rather than
+            reading the whole file
+        :return: a ``FrozenITree``
+        """
+        header, trees = read_index(path, mmap=mmap)
+        if header['keys'] is not None:
+            raise ValueError(f"{path} holds grouped trees; use "
+                             f"GroupedITree.load instead.")
+        return cls._from_columns(**trees[0])
+
+    def _augment(self):
+        # Fold each subtree's min and max into its root. Ranges are visited in
+        # post-order with an explicit stack so both children are complete
+        # before their parent.
+        n = len(self.starts)
+        if not n:
+            return
+
+        mins, maxs = self.mins, self.maxs
+        stack = [(0, n, False)]
+        while stack:
+            lo, hi, children_done = stack.pop()
+            mid = (lo + hi) >> 1
+            if not children_done:
+                stack.append((lo, hi, True))
+                if lo < mid:
+                    stack.append((lo, mid, False))
+                if mid + 1 < hi:
+                    stack.append((mid + 1, hi, False))
+                continue
+
+            if lo < mid:
+                c = (lo + mid) >> 1
+                mins[mid] = min(mins[mid], mins[c])
+                maxs[mid] = max(maxs[mid], maxs[c])
+            if mid + 1 < hi:
+                c = (mid + 1 + hi) >> 1
+                mins[mid] = min(mins[mid], mins[c])
+                maxs[mid] = max(maxs[mid], maxs[c])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        """Iterate over the contained interval objects in order of ``start``"""
+        intervals = self.intervals
+        return (intervals[k] for k in self.index)
+
+    def __repr__(self):
+        return f"FrozenITree(size={len(self)})"
+
+    def __contains__(self, i):
+        """Whether an interval with identical start and end is in the tree.
+
+        The starts are sorted, so this is a binary search followed by a scan
+        of the intervals with the same start.
+        """
+        starts, ends = self.starts, self.ends
+        lo = bisect_left(starts, i.start)
+        hi = bisect_right(starts, i.start, lo)
+        return any(ends[k] == i.end for k in range(lo, hi))
+
+    def search(self, i):
+        """Return all overlapping instances of a given interval.
+
+        The interval need not be of the same class but is required to have
+        a ``start`` and ``end`` attribute or parameter.
+        """
+        result = []
+        hi = len(self.starts)
+        if not hi:
+            return result
+
+        start, end = i.start, i.end
+        starts, ends, mins, maxs = self.starts, self.ends, self.mins, self.maxs
+        intervals, index = self.intervals, self.index
+
+        # The stack holds flattened (lo, hi) pairs of subtree ranges which
+        # are already known to overlap the query.
+        stack = [0, hi]
+        while stack:
+            hi = stack.pop()
+            lo = stack.pop()
+            mid = (lo + hi) >> 1
+
+            if starts[mid] <= end and start <= ends[mid]:
+                result.append(intervals[index[mid]])
+
+            if lo < mid:
+                c = (lo + mid) >> 1
+                if start <= maxs[c] and mins[c] <= end:
+                    stack.append(lo)
+                    stack.append(mid)
+            # everything to the right starts at or after this node
+            if mid + 1 < hi and starts[mid] <= end:
+                c = (mid + 1 + hi) >> 1
+                if start <= maxs[c] and mins[c] <= end:
+                    stack.append(mid + 1)
+                    stack.append(hi)
+
+        return result
+
+    def iter_search(self, i, limit: Optional[int] = None,
+                    ordered: bool = False):
+        """Iterate over the overlapping instances of a given interval.
+
+        See ``ITree.iter_search``.
+        """
+        if ordered:
+            hits = self._iter_search_ordered(i.start, i.end)
+        else:
+            hits = self._iter_search(i.start, i.end)
+        return hits if limit is None else itertools.islice(hits, limit)
+
+    def _iter_search(self, start: int, end: int):
+        starts, ends, mins, maxs = self.starts, self.ends, self.mins, self.maxs
+        intervals, index = self.intervals, self.index
+        hi = len(starts)
+        stack = [0, hi] if hi else []
+        while stack:
+            hi = stack.pop()
+            lo = stack.pop()
+            mid = (lo + hi) >> 1
+
+            if starts[mid] <= end and start <= ends[mid]:
+                yield intervals[index[mid]]
+
+            if lo < mid:
+                c = (lo + mid) >> 1
+                if start <= maxs[c] and mins[c] <= end:
+                    stack.append(lo)
+                    stack.append(mid)
+            if mid + 1 < hi and starts[mid] <= end:
+                c = (mid + 1 + hi) >> 1
+                if start <= maxs[c] and mins[c] <= end:
+                    stack.append(mid + 1)
+                    stack.append(hi)
+
+    def _iter_search_ordered(self, start: int, end: int):
+        # An in-order traversal of the implicit tree which skips subtrees
+        # that cannot overlap the interval. The stack holds the ranges whose
+        # root has not been visited yet.
+        starts, ends, mins, maxs = self.starts, self.ends, self.mins, self.maxs
+        intervals, index = self.intervals, self.index
+        stack = []
+        lo, hi = 0, len(starts)
+        while stack or lo < hi:
+            if lo < hi:
+                mid = (lo + hi) >> 1
+                if start <= maxs[mid] and mins[mid] <= end:
+                    stack.append((lo, hi))
+                    hi = mid
+                else:
+                    lo = hi
+            else:
+                lo, hi = stack.pop()
+                mid = (lo + hi) >> 1
+                if starts[mid] > end:
+                    # this and every later interval start after the query
+                    return
+                if start <= ends[mid]:
+                    yield intervals[index[mid]]
+                lo = mid + 1
+
+    def search_sorted(self, queries):
+        """Search for a stream of intervals sorted by ``start``.
+
+        See ``ITree.search_sorted``. The starts are sorted, so seeking to a
+        query is a binary search.
+        """
+        return _sweep_search(queries, self.search, self._seek,
+                             len(self).bit_length())
+
+    def _seek(self, pos: int):
+        # The intervals containing pos and an iterator over those starting
+        # after it, for _sweep_search.
+        intervals, index = self.intervals, self.index
+        following = (intervals[index[k]] for k in
+                     range(bisect_right(self.starts, pos), len(self.starts)))
+        return list(self._iter_search(pos, pos)), following
+
+    def join(self, other):
+        """Iterate over all pairs of overlapping intervals of two trees.
+
+        See ``ITree.join``.
+        """
+        return _sweep_join(iter(self), iter(other))
+
+    def overlaps(self, i) -> bool:
+        """Return whether any interval overlaps a given interval.
+
+        The search stops at the first overlapping interval.
+        """
+        return self._overlaps(i.start, i.end)
+
+    def _overlaps(self, start: int, end: int) -> bool:
+        return next(self._iter_search(start, end), None) is not None
+
+    def overlaps_many(self, starts, ends) -> List[bool]:
+        """Return whether anything overlaps each of many queries.
+
+        See ``ITree.overlaps_many``.
+        """
+        starts, ends = _as_sequence(starts), _as_sequence(ends)
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be of the same length.")
+
+        return [self._overlaps(start, end) for start, end in zip(starts, ends)]
+
+    def count(self, i) -> int:
+        """Return the number of intervals overlapping a given interval.
+
+        See ``ITree.count``. The starts are already sorted, and the sorted
+        ends are built on first use.
+        """
+        return bisect_right(self.starts, i.end) - \
+            bisect_left(self._ends_sorted(), i.start)
+
+    def count_many(self, starts, ends) -> array:
+        """Return the number of overlapping intervals for many queries.
+
+        See ``ITree.count_many``.
+        """
+        starts, ends = _as_sequence(starts), _as_sequence(ends)
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be of the same length.")
+
+        tree_starts, tree_ends = self.starts, self._ends_sorted()
+        return array('q', (
+            bisect_right(tree_starts, end) - bisect_left(tree_ends, start)
+            for start, end in zip(starts, ends)))
+
+    def _ends_sorted(self):
+        if self._sorted_ends is None:
+            self._sorted_ends = array('q', sorted(self.ends))
+        return self._sorted_ends
+
+    def search_within(self, i):
+        """Return all intervals lying entirely within a given interval.
+
+        See ``ITree.search_within``. Without the smallest end of each
+        subtree, only subtrees starting outside of the query are skipped.
+        """
+        result = []
+        hi = len(self.starts)
+        if not hi:
+            return result
+
+        start, end = i.start, i.end
+        starts, ends, mins, maxs = self.starts, self.ends, self.mins, self.maxs
+        intervals, index = self.intervals, self.index
+        stack = [0, hi]
+        while stack:
+            hi = stack.pop()
+            lo = stack.pop()
+            mid = (lo + hi) >> 1
+
+            if start <= starts[mid]:
+                if starts[mid] <= end and start <= ends[mid] <= end:
+                    result.append(intervals[index[mid]])
+                if lo < mid:
+                    c = (lo + mid) >> 1
+                    if start <= maxs[c] and mins[c] <= end:
+                        stack.append(lo)
+                        stack.append(mid)
+            if mid + 1 < hi and starts[mid] <= end:
+                c = (mid + 1 + hi) >> 1
+                if start <= maxs[c] and mins[c] <= end:
+                    stack.append(mid + 1)
+                    stack.append(hi)
+
+        return result
+
+    def search_enclosing(self, i):
+        """Return all intervals which entirely contain a given interval.
+
+        See ``ITree.search_enclosing``.
+        """
+        result = []
+        hi = len(self.starts)
+        if not hi:
+            return result
+
+        start, end = i.start, i.end
+        starts, ends, mins, maxs = self.starts, self.ends, self.mins, self.maxs
+        intervals, index = self.intervals, self.index
+        stack = [0, hi]
+        while stack:
+            hi = stack.pop()
+            lo = stack.pop()
+            mid = (lo + hi) >> 1
+
+            if starts[mid] <= start:
+                if end <= ends[mid]:
+                    result.append(intervals[index[mid]])
+                if mid + 1 < hi:
+                    c = (mid + 1 + hi) >> 1
+                    if end <= maxs[c] and mins[c] <= start:
+                        stack.append(mid + 1)
+                        stack.append(hi)
+            if lo < mid:
+                c = (lo + mid) >> 1
+                if end <= maxs[c] and mins[c] <= start:
+                    stack.append(lo)
+                    stack.append(mid)
+
+        return result
+
+    def search_many(self, starts, ends):
+        """Search for many intervals at once.
+
+        See ``ITree.search_many``.
+
+        :return: a tuple ``(offsets, hits)`` in compressed sparse row form.
+            ``hits`` is a list of the overlapping interval objects and the
+            hits of the k-th query are ``hits[offsets[k]:offsets[k + 1]]``.
+        """
+        offsets, hits = self.search_many_indices(starts, ends)
+        intervals = self.intervals
+        return offsets, [intervals[h] for h in hits]
+
+    def search_many_indices(self, starts, ends):
+        """Search for many intervals at once, returning indices of the hits.
+
+        Like ``search_many``, but no interval objects are looked up, so the
+        result is two compact arrays, e.g. to be passed between processes.
+
+        :param starts: a sequence or NumPy array of query starts
+        :param ends: a sequence or NumPy array of query ends, of the same
+            length as ``starts``
+        :return: a tuple ``(offsets, hits)`` of integer arrays in compressed
+            sparse row form. The hits of the k-th query are
+            ``hits[offsets[k]:offsets[k + 1]]``, each an index into
+            ``intervals``.
+        """
+        starts, ends = _as_sequence(starts), _as_sequence(ends)
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be of the same length.")
+
+        offsets = array('q', [0])
+        hits = array('q')
+        n = len(self.starts)
+        tree_starts, tree_ends = self.starts, self.ends
+        mins, maxs, index = self.mins, self.maxs, self.index
+        for start, end in zip(starts, ends):
+            stack = [0, n] if n else []
+            while stack:
+                hi = stack.pop()
+                lo = stack.pop()
+                mid = (lo + hi) >> 1
+
+                if tree_starts[mid] <= end and start <= tree_ends[mid]:
+                    hits.append(index[mid])
+
+                if lo < mid:
+                    c = (lo + mid) >> 1
+                    if start <= maxs[c] and mins[c] <= end:
+                        stack.append(lo)
+                        stack.append(mid)
+                if mid + 1 < hi and tree_starts[mid] <= end:
+                    c = (mid + 1 + hi) >> 1
+                    if start <= maxs[c] and mins[c] <= end:
+                        stack.append(mid + 1)
+                        stack.append(hi)
+            offsets.append(len(hits))
+
+        return offsets, hits
+
+
+class _StoredIntervals(object):
+    # The intervals of a tree loaded without its objects. Such trees are
+    # saved in order of start, so an interval's index is its position.
+
+    def __init__(self, starts, ends):
+        self.starts, self.ends = starts, ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, k):
+        return Interval(self.starts[k], self.ends[k])
+
+
+def _sweep_search(queries, search, seek, skip_limit: int):
+    # Search for a stream of queries sorted by start. See
+    # ``ITree.search_sorted``. search(q) returns the intervals overlapping
+    # a query, and seek(pos) returns the intervals containing pos and an
+    # iterator over the intervals starting after pos in order of start.
+    #
+    # While the queries overlap, the tree is swept alongside them. The
+    # intervals starting at or before the current query's start are kept in
+    # a heap by end: once those ending before it are popped, the rest all
+    # overlap the query and every later one. The intervals already read
+    # which start after the query's start are kept in order in
+    # ahead[head:], so a wide query does not slow down the narrower queries
+    # after it. A query is searched on its own instead when it does not
+    # overlap the previous one, or when more than skip_limit unread
+    # intervals start before it, and the sweep then seeks to the next query
+    # which overlaps its predecessor.
+    done = object()
+    live, ahead, head = [], [], 0
+    following, pending = None, done
+    order = itertools.count()
+    last_start = last_end = None
+    for q in queries:
+        start, end = q.start, q.end
+        if last_start is not None and start < last_start:
+            raise ValueError(
+                f"queries are not sorted by start: {start} follows "
+                f"{last_start}")
+        overlapping = last_end is not None and start <= last_end
+        last_start, last_end = start, end
+
+        if following is not None:
+            n_ahead = len(ahead)
+            while head < n_ahead and ahead[head].start <= start:
+                i = ahead[head]
+                heappush(live, (i.end, next(order), i))
+                head += 1
+            if head == n_ahead:
+                ahead, head = [], 0
+                moved = 0
+                while pending is not done and pending.start <= start:
+                    if moved == skip_limit:
+                        following = None
+                        break
+                    heappush(live, (pending.end, next(order), pending))
+                    pending = next(following, done)
+                    moved += 1
+            elif head > 64 and 2 * head > n_ahead:
+                del ahead[:head]
+                head = 0
+        if following is None:
+            if not overlapping:
+                yield search(q)
+                continue
+            containing, following = seek(start)
+            live = [(i.end, next(order), i) for i in containing]
+            heapify(live)
+            ahead, head = [], 0
+            pending = next(following, done)
+
+        while live and live[0][0] < start:
+            heappop(live)
+        hits = [entry[2] for entry in live]
+        k, n_ahead = head, len(ahead)
+        while k < n_ahead and ahead[k].start <= end:
+            k += 1
+        hits.extend(ahead[head:k])
+        if k == n_ahead:
+            while pending is not done and pending.start <= end:
+                ahead.append(pending)
+                hits.append(pending)
+                pending = next(following, done)
+        yield hits
+
+
+def _sweep_join(left, right):
+    # Merge two iterators of intervals sorted by start. Whenever an interval
+    # is reached, every interval of the other side which started earlier and
+    # has not yet ended overlaps it. Intervals ending before the current
+    # start can never overlap a later one and are dropped from the active
+    # lists, so each list entry is either dropped once or produces a pair.
+    done = object()
+    active_left, active_right = [], []
+    a, b = next(left, done), next(right, done)
+    while a is not done or b is not done:
+        if b is done or (a is not done and a.start <= b.start):
+            if b is done and not active_right:
+                return
+            start = a.start
+            active_right = [x for x in active_right if x.end >= start]
+            for x in active_right:
+                yield a, x
+            active_left.append(a)
+            a = next(left, done)
+        else:
+            if a is done and not active_left:
+                return
+            start = b.start
+            active_left = [x for x in active_left if x.end >= start]
+            for x in active_left:
+                yield x, b
+            active_right.append(b)
+            b = next(right, done)
+
+
+def _as_sequence(values):
+    # NumPy arrays are converted to lists so that iteration yields plain
+    # Python integers rather than slower array scalars.
+    tolist = getattr(values, 'tolist', None)
+    return tolist() if tolist is not None else values
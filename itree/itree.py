@@ -1,11 +1,25 @@
 """
 Interval tree implementation suitable for gene objects.
 """
+import collections
+import contextlib
+import os
 import sys
 import inspect
 import itertools
+import tempfile
+import threading
+import weakref
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from bisect import bisect_left, bisect_right
 from typing import List, Optional
 
+from .bed import read_bed
+from .frozen import FrozenITree, _as_sequence, _sweep_join, _sweep_search
+from .stats import TreeStats
+from .storage import read_index, write_index
+
 """
 
 This is a special case of the AVL balanced binary search tree in which we keep
@@ -33,6 +47,13 @@ and the minimum prevents us from, in this example, exploring the rightmost
 leaf.
 """
 
+# The cost of rebuilding a tree, per node, relative to the cost of one level of
+# descent and retracing in a single insertion or removal.
+_REBUILD_STEP_RATIO = 0.2
+
+# The methods replaced on a tree while it collects statistics
+_INSTRUMENTED = ('_search', '_insert', '_remove', '_rebuild', '_rotate')
+
 
 class ITreeNode(object):
     """Internal wrapper object for an interval tree node.
@@ -43,17 +64,33 @@ class ITreeNode(object):
     return the original matching object.
     """
 
+    # Nodes are by far the most numerous objects, so they are slotted and
+    # keep their children and interval coordinates in plain attributes.
+    __slots__ = ('i', 'start', 'end', 'left', 'right', 'min', 'max', 'min_end',
+                 'height', 'size')
+
     def __init__(self, i):
         """Initialize a an ITreeNode object.
 
         :param i: An interval object with ``start`` and ``end``
             properties/attributes.
         """
-        self.interval = i
+        self.i = i
+        self.start: int = i.start
+        self.end: int = i.end
         self.min: int = min(i.start, i.end)
         self.max: int = max(i.end, i.start)
-        self.c: List[ITreeNode] = [None, None]
+        #: The smallest ``end`` in the subtree rooted at this node
+        self.min_end: int = i.end
+        #: The left child of the node. Its (start, end) is less than or
+        #: equal to the node's.
+        self.left: Optional[ITreeNode] = None
+        #: The right child of the node. Its (start, end) is greater than or
+        #: equal to the node's.
+        self.right: Optional[ITreeNode] = None
         self.height: int = 1
+        #: The number of intervals in the subtree rooted at this node
+        self.size: int = 1
 
     @property
     def interval(self):
@@ -66,28 +103,6 @@ class ITreeNode(object):
         self.start = i.start
         self.end = i.end
 
-    @property
-    def left(self):
-        """The left child of the node
-
-        The left child start is less than or equal to the node's start"""
-        return self.c[0]
-
-    @left.setter
-    def left(self, n):
-        self.c[0] = n
-
-    @property
-    def right(self):
-        """The right child of the node
-
-        The right child start is greater than or equal to the node's start"""
-        return self.c[1]
-
-    @right.setter
-    def right(self, n):
-        self.c[1] = n
-
     def __repr__(self):
         return self.pstring()
         # return f"ITreeNode({self.start},{self.end})"  # ,max={self.max}," \
@@ -127,15 +142,203 @@ class ITree(object):
     requirements.
     """
 
-    def __init__(self, nodes=None):
-        """Initialize an interval tree, optionally with interval objects."""
+    def __init__(self, nodes=None, buckets: bool = False,
+                 cache_size: int = 0, persistent: bool = False):
+        """Initialize an interval tree, optionally with interval objects.
+
+        :param nodes: an iterable of interval objects to insert
+        :param buckets: keep all intervals with the same ``start`` and
+            ``end`` in a single node. This shrinks trees with many
+            duplicated coordinates. The ``i`` attribute of each node is then
+            a list of the interval objects.
+        :param cache_size: keep the results of up to this many distinct
+            ``search`` queries, discarding the least recently used. Results
+            are recomputed after the tree is modified. The cache may be
+            shared by searches in several threads. See ``cache_info``.
+        :param persistent: never modify a node once it is part of the tree.
+            Mutations copy the nodes they change and then replace the root,
+            so readers holding an earlier root, such as snapshots, are not
+            affected. See ``snapshot``.
+        """
         self.root = None
+        self._buckets = buckets
+        self._persistent = persistent
+        # incremented by every mutation to invalidate derived indexes
+        self._version = 0
+        self._coordinate_index = None
+        self._cache = _ResultCache(cache_size) if cache_size > 0 else None
+        self._stats = None
+        self._lock = _ReadWriteLock()
         if nodes is not None:
             for n in nodes:
                 self.insert(n)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        # the methods instrumented for statistics are closures, which are
+        # bound again on unpickling
+        for name in _INSTRUMENTED:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = _ReadWriteLock()
+        if self._stats is not None:
+            self._instrument(self._stats)
+
+    @classmethod
+    def from_intervals(cls, intervals, presorted=False,
+                       buckets: bool = False, cache_size: int = 0,
+                       persistent: bool = False):
+        """Build a balanced interval tree from a collection of intervals.
+
+        Rather than inserting and rebalancing one interval at a time, the
+        intervals are sorted once by ``start`` and ``end`` and the tree is
+        assembled bottom-up with the median of each range as its root, so
+        every node's ``min``, ``max`` and ``height`` are computed exactly
+        once.
+
+        :param intervals: an iterable of objects with ``start`` and ``end``
+            attributes or properties.
+        :param presorted: set to ``True`` if ``intervals`` is already sorted
+            by ``start`` and then ``end`` to skip the sort. Intervals with
+            the same ``start`` must be sorted by ``end`` too, as the tree is
+            ordered by both; the order is checked in a single pass.
+        :param buckets: keep duplicated intervals in a single node, as for
+            ``ITree``.
+        :param cache_size: the number of search results to cache, as for
+            ``ITree``.
+        :param persistent: copy nodes rather than modify them, as for
+            ``ITree``.
+        :return: a new ``ITree``
+        :raises ValueError: if ``presorted`` is set but the intervals are not
+            sorted by ``start`` and ``end``
+        """
+        if not presorted:
+            intervals = sorted(intervals, key=lambda i: (i.start, i.end))
+        tree = cls(buckets=buckets, cache_size=cache_size,
+                   persistent=persistent)
+        nodes = [ITreeNode(i) for i in intervals]
+        if presorted:
+            for a, b in zip(nodes, nodes[1:]):
+                if (b.start, b.end) < (a.start, a.end):
+                    raise ValueError(
+                        f"intervals are not sorted by start and end: "
+                        f"({b.start},{b.end}) follows ({a.start},{a.end})")
+        if buckets:
+            for n in nodes:
+                n.i = [n.i]
+            nodes = _merge_buckets(nodes)
+        tree.root = cls._build(nodes, buckets)
+        return tree
+
+    @classmethod
+    def _build(cls, nodes: List[ITreeNode],
+               buckets: bool = False) -> Optional[ITreeNode]:
+        # Link a list of nodes sorted by (start, end) into a perfectly
+        # balanced tree. Each node is finished after both of its children.
+        # The recursion is only O(log n) deep, and inlining the limit
+        # comparisons makes it several times faster than a stack of ranges.
+        if not nodes:
+            return None
+
+        def link(lo, hi):
+            mid = (lo + hi) // 2
+            n = nodes[mid]
+            size = len(n.i) if buckets else 1
+            low, high, low_end, height = n.min, n.max, n.min_end, 0
+            if lo < mid:
+                c = n.left = link(lo, mid)
+                size += c.size
+                if c.min < low:
+                    low = c.min
+                if c.max > high:
+                    high = c.max
+                if c.min_end < low_end:
+                    low_end = c.min_end
+                height = c.height
+            else:
+                n.left = None
+            if mid + 1 < hi:
+                c = n.right = link(mid + 1, hi)
+                size += c.size
+                if c.min < low:
+                    low = c.min
+                if c.max > high:
+                    high = c.max
+                if c.min_end < low_end:
+                    low_end = c.min_end
+                if c.height > height:
+                    height = c.height
+            else:
+                n.right = None
+            n.size, n.min, n.max, n.height = size, low, high, height + 1
+            n.min_end = low_end
+            return n
+
+        return link(0, len(nodes))
+
     def __len__(self):
-        return self._child_count(self.root)
+        return self._size(self.root)
+
+    def snapshot(self):
+        """Return a copy of the tree in constant time.
+
+        The copy shares all of its nodes with this tree. Both trees are
+        switched to persistent mode, in which mutations copy the O(log n)
+        nodes that they change instead of modifying them, so neither tree
+        sees the changes made to the other. A snapshot can therefore be
+        searched by other threads while this tree is being modified,
+        without any locking. The interval objects themselves are shared.
+
+        :return: a new ``ITree``
+        """
+        self._persistent = True
+        tree = type(self)(buckets=self._buckets, persistent=True)
+        tree.root = self.root
+        tree._version = self._version
+        return tree
+
+    def save(self, path: str, payload: bool = True):
+        """Save the tree to a binary index file.
+
+        The tree is stored in the columnar form of a ``FrozenITree``. The
+        payload of interval objects is pickled, so files to be shared with
+        others should be saved with ``payload=False``. See
+        ``FrozenITree.save``.
+        """
+        FrozenITree(self).save(path, payload=payload)
+
+    @staticmethod
+    def load(path: str, mmap: bool = True):
+        """Load a tree saved with ``save``.
+
+        Loading does not rebuild the tree: it is returned as a read-only
+        ``FrozenITree`` backed by the file's columns. A payload of interval
+        objects is unpickled, which can run arbitrary code, so only load
+        files from trusted sources. See ``FrozenITree.load``.
+        """
+        return FrozenITree.load(path, mmap=mmap)
+
+    def __iter__(self):
+        """Iterate over the contained interval objects in order of ``start``"""
+        if self._buckets:
+            return itertools.chain.from_iterable(n.i for n in self._nodes())
+        return self._iter()
+
+    def _iter(self):
+        stack = []
+        n = self.root
+        while stack or n is not None:
+            if n is not None:
+                stack.append(n)
+                n = n.left
+            else:
+                n = stack.pop()
+                yield n.i
+                n = n.right
 
     def __repr__(self):
         return f"ITree(root={self.root})"
@@ -171,15 +374,14 @@ class ITree(object):
 
         return f"{left_subtree_string}{(' '*level)+corner}–{node_string}\n{right_subtree_string}"
 
-    def _child_count(self, n):
-        if n is None:
-            return 0
-        return 1 + self._child_count(n.left) + self._child_count(n.right)
-
     @staticmethod
     def _height(n):
         return n.height if n is not None else 0
 
+    @staticmethod
+    def _size(n):
+        return n.size if n is not None else 0
+
     @staticmethod
     def _max(n):
         return n.max if n is not None else 0
@@ -188,6 +390,10 @@ class ITree(object):
     def _min(n):
         return n.min if n is not None else sys.maxsize
 
+    @staticmethod
+    def _min_end(n):
+        return n.min_end if n is not None else sys.maxsize
+
     def _rotate(self, n: ITreeNode, heavy: bool) -> ITreeNode:
         # Rotate a tree to balance it. This generalizes the left and right
         # rotate operations by denoting "heavy" as the side which will
@@ -199,27 +405,43 @@ class ITree(object):
         #     r               ----> right              n
         #   /   \             left <-----            /   \
         #         t                                t
-        light = not heavy
-
         # save the nodes that will be exchanged (r=new root, t=moved subtree)
-        r = n.c[heavy]
-        t = r.c[light]
-
-        # exchange the children
-        r.c[light] = n
-        n.c[heavy] = t
+        # and exchange the children. In persistent mode both nodes are
+        # copied since either may be shared with a snapshot.
+        if self._persistent:
+            n = _copy_node(n)
+            if heavy:
+                n.right = _copy_node(n.right)
+            else:
+                n.left = _copy_node(n.left)
+        if heavy:
+            r = n.right
+            t = r.left
+            r.left = n
+            n.right = t
+        else:
+            r = n.left
+            t = r.right
+            r.right = n
+            n.left = t
 
         # update the heights for future balancing operations. In most cases
         # it will be unknown if the child is None, hence the helper functions.
-        n.height = 1 + max(self._height(n.c[light]), self._height(n.c[heavy]))
-        r.height = 1 + max(r.c[light].height, self._height(r.c[heavy]))
+        # n is now a child of r, so it must be updated first.
+        n.height = 1 + max(self._height(n.left), self._height(n.right))
+        r.height = 1 + max(self._height(r.left), self._height(r.right))
 
-        # Update the mins and maxes of the nodes.
-        n.max = max(self._max(n.c[light]), self._max(n.c[heavy]), n.end)
-        r.max = max(r.c[light].max, self._max(r.c[heavy]), r.end)
+        # Update the limits of the nodes. r now holds the intervals of n's
+        # whole subtree, so it takes over n's limits.
+        r.min, r.max, r.min_end = n.min, n.max, n.min_end
+        n.max = max(self._max(n.left), self._max(n.right), n.end)
+        n.min = min(self._min(n.left), self._min(n.right), n.start)
+        n.min_end = min(self._min_end(n.left), self._min_end(n.right), n.end)
 
-        n.min = min(self._min(n.c[light]), self._min(n.c[heavy]), n.start)
-        r.min = min(r.c[light].min, self._min(r.c[heavy]), r.start)
+        # r takes over the whole subtree, n loses r but gains t
+        size = n.size
+        n.size = size - r.size + self._size(t)
+        r.size = size
 
         return r
 
@@ -229,23 +451,99 @@ class ITree(object):
         The object is wrapped in an internal structure and need only have
         a ``start`` and ``end`` attribute or property.
         """
-        self.root = self._insert(self.root, ITreeNode(i))
-
-    def _insert(self, n: ITreeNode, nn: ITreeNode) -> ITreeNode:
+        with self._lock.writing():
+            self._version += 1
+            self._insert(self._new_node(i))
+
+    def _new_node(self, i) -> ITreeNode:
+        nn = ITreeNode(i)
+        if self._buckets:
+            nn.i = [i]
+        return nn
+
+    def _insert(self, nn: ITreeNode):
+        n = self.root
         if n is None:
-            return nn
-
-        # set the upper limit
-        n.max = max(nn.end, n.max)
-        n.min = min(nn.start, n.min)
+            self.root = nn
+            return
+
+        # Descend to the insertion point, keeping the path for rebalancing.
+        # Every node on the way gains nn in its subtree, so its limits can be
+        # set on the way down.
+        start, end = nn.start, nn.end
+        buckets, persistent = self._buckets, self._persistent
+        path = []
+        while n is not None:
+            if persistent:
+                # work on a copy of the path, leaving snapshots untouched
+                c = _copy_node(n)
+                if path:
+                    if path[-1].left is n:
+                        path[-1].left = c
+                    else:
+                        path[-1].right = c
+                n = c
+            if end > n.max:
+                n.max = end
+            if start < n.min:
+                n.min = start
+            if end < n.min_end:
+                n.min_end = end
+            n.size += 1
+            path.append(n)
+            if start < n.start or (start == n.start and end < n.end):
+                n = n.left
+            elif buckets and start == n.start and end == n.end:
+                # the shape of the tree is unchanged
+                if persistent:
+                    n.i = n.i + nn.i
+                else:
+                    n.i.extend(nn.i)
+                self.root = path[0]
+                return
+            else:
+                n = n.right
 
-        # insert the to either the right or left subtree
-        if nn.start < n.start:
-            n.left = self._insert(n.left, nn)
+        # insert the to either the right or left subtree of the last node
+        p = path[-1]
+        if start < p.start or (start == p.start and end < p.end):
+            p.left = nn
         else:
-            n.right = self._insert(n.right, nn)
-
-        return self._rebalance(n)
+            p.right = nn
+
+        self.root = self._retrace(path, len(path))
+
+    def _retrace(self, path: List[ITreeNode], floor: int,
+                 update_limits: bool = False) -> ITreeNode:
+        # Rebalance the nodes of a root-to-leaf path from the bottom up after
+        # an insert or delete, returning the new root. Once a subtree has its
+        # former height and limits, nothing above it can change and we can
+        # stop early, but only at or above the path index ``floor``. If
+        # ``update_limits`` is set, the min, max and min_end are recomputed
+        # from the children.
+        for k in range(len(path) - 1, -1, -1):
+            n = path[k]
+            height, lo, hi, lo_end = n.height, n.min, n.max, n.min_end
+            if update_limits:
+                n.min = min(self._min(n.left), self._min(n.right), n.start)
+                n.max = max(self._max(n.left), self._max(n.right), n.end)
+                n.min_end = min(self._min_end(n.left),
+                                self._min_end(n.right), n.end)
+
+            r = self._rebalance(n)
+            if r is not n:
+                if k == 0:
+                    return r
+                elif path[k - 1].left is n:
+                    path[k - 1].left = r
+                else:
+                    path[k - 1].right = r
+
+            if k <= floor and r.height == height and r.min == lo and \
+                    r.max == hi and r.min_end == lo_end:
+                return path[0]
+
+        return path[0]
 
     def _rebalance(self, n: ITreeNode) -> ITreeNode:
         # rebalance a tree
@@ -281,13 +579,49 @@ class ITree(object):
     def remove(self, i):
         """Remove an interval from a tree
 
-        The object must be present in the tree (identical start and stop).
+        An interval with identical start and end must be present in the
+        tree, though it need not be the same object. If several intervals
+        match, only one of them is removed.
+
+        :raises KeyError: if there is no matching interval
         """
-        self.root = self._remove(self.root, None, False, ITreeNode(i))
+        with self._lock.writing():
+            removed = self._remove(i)
+        if not removed:
+            raise KeyError(f"no interval ({i.start},{i.end}) in the tree")
 
-    def _remove(self, n: ITreeNode, p: Optional[ITreeNode],
-                right_parent: bool, nn: ITreeNode) -> Optional[ITreeNode]:
-        """Removal helper function """
+    def discard(self, i):
+        """Remove an interval from a tree if it is present
+
+        Like ``remove``, but does nothing if there is no matching interval.
+        """
+        with self._lock.writing():
+            self._remove(i)
+
+    def __contains__(self, i):
+        """Whether an interval with identical start and end is in the tree"""
+        return self._find_path(i.start, i.end) is not None
+
+    def _remove(self, i) -> bool:
+        """Removal helper function, returning whether a node was removed"""
+
+        path = self._find_path(i.start, i.end)
+        if path is None:
+            return False
+        self._version += 1
+        persistent = self._persistent
+        if persistent:
+            path = _copy_path(path)
+
+        bucket = path[-1].i if self._buckets else None
+        if bucket is not None and len(bucket) > 1:
+            if persistent:
+                bucket = path[-1].i = list(bucket)
+            _discard_from_bucket(bucket, i)
+            for p in path:
+                p.size -= 1
+            self.root = path[0]
+            return True
 
         # BST removal consists of 3 cases:
         # 1 if the node has 2 children, the node is replaced with the value
@@ -297,38 +631,224 @@ class ITree(object):
         #   then points to the nodes only child
         # 3 if the node has no children the node is simply removed.
 
-        # case 1 implies that case 2 or 3 will be performed on a child node,
-        # so long as it is found. successive updates to the nodes will be
-        # propagated up after the child removal
+        # case 1 implies that case 2 or 3 will be performed on a child node.
+        # The limits of every node below the found node may then change, so
+        # the rebalancing cannot stop early beneath it.
+
+        # Every node on the path to the removed node loses one interval
+        for p in path:
+            p.size -= 1
+
+        n = path[-1]
+        floor = len(path) - 1
+        if n.left is not None and n.right is not None:
+            successor_path = [n.right]
+            while successor_path[-1].left is not None:
+                successor_path.append(successor_path[-1].left)
+            if persistent:
+                successor_path = _copy_path(successor_path)
+                n.right = successor_path[0]
+            path.extend(successor_path)
+            min_right_child = successor_path[-1]
+            # the successor's intervals move up out of these subtrees
+            weight = len(min_right_child.i) if self._buckets else 1
+            for p in path[floor + 1:]:
+                p.size -= weight
+            n.i = min_right_child.i
+            n.start = min_right_child.start
+            n.end = min_right_child.end
+            n = min_right_child
+
+        # less than two children, we bridge the parent to the child
+        child = n.left if n.left is not None else n.right
+        path.pop()
+        if not path:
+            self.root = child
+            return True
+        if path[-1].left is n:
+            path[-1].left = child
+        else:
+            path[-1].right = child
+
+        self.root = self._retrace(path, floor, update_limits=True)
+        return True
+
+    def insert_many(self, intervals):
+        """Insert many intervals into the tree.
+
+        Depending on the number of intervals and the size of the tree, the
+        intervals are either inserted one at a time or merged with the
+        existing ones and the whole tree rebuilt as in ``from_intervals``.
 
-        if nn.start == n.start and nn.end == n.end:
-            if n.left is not None and n.right is not None:
-                min_right_child = self._min_child(n.right)
-                n.interval = min_right_child.interval
-                n.right = self._remove(n.right, n, True, min_right_child)
+        :param intervals: an iterable of interval objects
+        """
+        intervals = list(intervals)
+        if not intervals:
+            return
+        with self._lock.writing():
+            self._insert_many(intervals)
+
+    def _insert_many(self, intervals):
+        if not self._rebuild_is_cheaper(len(intervals)):
+            self._version += 1
+            for i in intervals:
+                self._insert(self._new_node(i))
+            return
+
+        # the existing nodes are already in order, so the sort merges two
+        # sorted runs in linear time
+        new = [self._new_node(i) for i in intervals]
+        nodes = self._detached_nodes()
+        nodes.extend(new)
+        nodes.sort(key=lambda n: (n.start, n.end))
+        if self._buckets:
+            nodes = _merge_buckets(nodes)
+        self._rebuild(nodes)
+
+    def remove_many(self, intervals) -> int:
+        """Remove many intervals from the tree.
+
+        As with ``discard``, intervals which are not in the tree are ignored.
+        Depending on the number of intervals and the size of the tree, the
+        intervals are either removed one at a time or the remaining ones are
+        collected in order and the whole tree rebuilt.
+
+        :param intervals: an iterable of interval objects
+        :return: the number of intervals removed
+        """
+        intervals = list(intervals)
+        if not intervals:
+            return 0
+        with self._lock.writing():
+            return self._remove_many(intervals)
+
+    def _remove_many(self, intervals) -> int:
+        if not self._rebuild_is_cheaper(len(intervals)):
+            return sum(self._remove(i) for i in intervals)
+
+        pending = collections.defaultdict(list)
+        for i in intervals:
+            pending[i.start, i.end].append(i)
+        removed = 0
+        nodes = []
+        for n in self._detached_nodes():
+            matches = pending.get((n.start, n.end))
+            if not matches:
+                nodes.append(n)
+            elif self._buckets:
+                while matches and n.i:
+                    _discard_from_bucket(n.i, matches.pop())
+                    removed += 1
+                if n.i:
+                    nodes.append(n)
             else:
-                # less than two children, we bridge the parent to the child
-                n = n.left or n.right
-                if p is not None:
-                    p.c[right_parent] = n
-                if n is None:
-                    return None
-        else:
-            if n.left and nn.start <= n.left.max and n.left.min <= nn.end:
-                n.left = self._remove(n.left, n, False, nn)
-            if n.right and nn.start <= n.right.max and n.right.min <= nn.end:
-                n.right = self._remove(n.right, n, True, nn)
+                matches.pop()
+                removed += 1
+        if removed:
+            self._rebuild(nodes)
+        return removed
+
+    def _rebuild_is_cheaper(self, k: int) -> bool:
+        # k single mutations each descend and retrace about log2(n) nodes,
+        # while a rebuild visits all n nodes a few times. The factor is the
+        # measured cost of a rebuild per node relative to one step of a
+        # single mutation (see ``benchmarking.py batch``).
+        n = len(self)
+        return k * (n + k).bit_length() * _REBUILD_STEP_RATIO >= n + k
+
+    def _nodes(self):
+        # the nodes of the tree in order
+        stack = []
+        n = self.root
+        while stack or n is not None:
+            if n is not None:
+                stack.append(n)
+                n = n.left
+            else:
+                n = stack.pop()
+                yield n
+                n = n.right
+
+    def _detached_nodes(self) -> List[ITreeNode]:
+        # The nodes of the tree in order, ready to be relinked by a rebuild.
+        # In persistent mode they (and their buckets) are copies, so that the
+        # nodes of snapshots are left untouched.
+        if not self._persistent:
+            return list(self._nodes())
+        nodes = [_copy_node(n) for n in self._nodes()]
+        if self._buckets:
+            for n in nodes:
+                n.i = list(n.i)
+        return nodes
+
+    def _rebuild(self, nodes: List[ITreeNode]):
+        # Relink a list of sorted nodes into a balanced tree, resetting the
+        # limits that they held as subtree roots.
+        for n in nodes:
+            n.min = min(n.start, n.end)
+            n.max = max(n.start, n.end)
+            n.min_end = n.end
+        self._version += 1
+        self.root = self._build(nodes, self._buckets)
+
+    def select(self, k: int):
+        """Return the k-th interval object in order of ``start``.
+
+        Like list indices, ``k`` is zero-based and may be negative to count
+        from the last interval. Runs in O(log n), so an interval can be
+        sampled uniformly with ``t.select(random.randrange(len(t)))``.
+        """
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("ITree index out of range")
+
+        buckets = self._buckets
+        n = self.root
+        while True:
+            left_size = self._size(n.left)
+            weight = len(n.i) if buckets else 1
+            if k < left_size:
+                n = n.left
+            elif k < left_size + weight:
+                return n.i[k - left_size] if buckets else n.i
+            else:
+                k -= left_size + weight
+                n = n.right
 
-        n.min = min(self._min(n.left), self._min(n.right), n.start)
-        n.max = max(self._max(n.left), self._max(n.right), n.end)
+    def rank(self, position: int) -> int:
+        """Return the number of intervals starting before a position.
 
-        return self._rebalance(n)
+        This is also the index at which an interval starting at ``position``
+        would be found by ``select``. Runs in O(log n).
+        """
+        count = 0
+        n = self.root
+        while n is not None:
+            if n.start < position:
+                # the node's own intervals and those of its left subtree
+                count += n.size - self._size(n.right)
+                n = n.right
+            else:
+                n = n.left
+        return count
+
+    def _find_path(self, start: int, end: int) -> Optional[List[ITreeNode]]:
+        # Find a node exactly matching start and end, returning the path to it
+        # from the root, or None if there is no such node. Nodes are ordered
+        # by (start, end), so this is a single descent.
+        path = []
+        n = self.root
+        while n is not None:
+            path.append(n)
+            if start < n.start or (start == n.start and end < n.end):
+                n = n.left
+            elif start == n.start and end == n.end:
+                return path
+            else:
+                n = n.right
 
-    def _min_child(self, n: ITreeNode):
-        if n.left is None:
-            return n
-        else:
-            return self._min_child(n.left)
+        return None
 
     def search(self, i):
         """Return all overlapping instances of a given interval.
@@ -336,37 +856,697 @@ class ITree(object):
         The interval need not be of the same class but is required to have
         a ``start`` and ``end`` attribute or parameter.
         """
+        cache = self._cache
+        if cache is None:
+            return self._search(i.start, i.end)
+
+        # the version is read once, before searching, so that a mutation by
+        # another thread cannot file an old result under its new version
+        key, version = (i.start, i.end), self._version
+        result = cache.get(key, version)
+        if result is None:
+            result = self._search(i.start, i.end)
+            cache.put(key, version, result)
+        # the caller may modify the list, so the cached one is copied
+        return list(result)
+
+    def cache_info(self):
+        """Return the statistics of the search result cache.
+
+        :return: a ``CacheInfo`` tuple of ``hits``, ``misses``, ``maxsize``
+            and ``currsize``, or ``None`` if the tree has no cache
+        """
+        return self._cache.info() if self._cache is not None else None
 
+    def cache_clear(self):
+        """Empty the search result cache and reset its statistics"""
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _search(self, start: int, end: int):
         # We use a non-recursive implementation since recursion is expensive
         result = []
-        if self.root is None:
+        root = self.root
+        if root is None:
             return result
 
         # Add the first node
-        stack = [self.root]
-        while len(stack):
+        add = result.extend if self._buckets else result.append
+        stack = [root]
+        while stack:
             n = stack.pop()
 
             # Add the object to the result if it overlaps
-            if n.start <= i.end and i.start <= n.end:
-                result.append(n.i)
+            if n.start <= end and start <= n.end:
+                add(n.i)
 
             # Explore subtrees that overlap with the interval
-            if n.left and i.start <= n.left.max and n.left.min <= i.end:
-                stack.append(n.left)
-            if n.right and i.start <= n.right.max and n.right.min <= i.end:
-                stack.append(n.right)
+            left, right = n.left, n.right
+            if left is not None and start <= left.max and left.min <= end:
+                stack.append(left)
+            if right is not None and start <= right.max and right.min <= end:
+                stack.append(right)
 
         return result
 
+    def enable_stats(self) -> TreeStats:
+        """Start collecting statistics of searches and mutations.
+
+        The instrumented methods replace the regular ones on this tree only
+        while statistics are enabled, so a tree without statistics pays
+        nothing for them. Calling this again resets the statistics.
+
+        :return: the ``TreeStats`` that will be updated, also available as
+            ``stats``
+        """
+        self.disable_stats()
+        return self._instrument(TreeStats())
+
+    def _instrument(self, stats: TreeStats) -> TreeStats:
+        # Replace the regular methods with ones updating stats.
+        self._stats = stats
+        self._search = self._search_with_stats
+
+        def insert(nn):
+            stats.inserts += 1
+            ITree._insert(self, nn)
+
+        def remove(i):
+            removed = ITree._remove(self, i)
+            stats.removes += removed
+            return removed
+
+        def rebuild(nodes):
+            stats.rebuilds += 1
+            ITree._rebuild(self, nodes)
+
+        def rotate(n, heavy):
+            stats.rotations += 1
+            return ITree._rotate(self, n, heavy)
+
+        self._insert, self._remove = insert, remove
+        self._rebuild, self._rotate = rebuild, rotate
+        return stats
+
+    def disable_stats(self):
+        """Stop collecting statistics and restore the regular methods"""
+        self._stats = None
+        for name in _INSTRUMENTED:
+            self.__dict__.pop(name, None)
+
+    @property
+    def stats(self) -> Optional[TreeStats]:
+        """The statistics collected since ``enable_stats``, or ``None``"""
+        return self._stats
+
+    def _search_with_stats(self, start: int, end: int):
+        # The same traversal as _search, counting the work done
+        stats = self._stats
+        stats.searches += 1
+        result = []
+        add = result.extend if self._buckets else result.append
+        root = self.root
+        stack = [root] if root is not None else []
+        max_stack = len(stack)
+        while stack:
+            n = stack.pop()
+            stats.visited += 1
+            if n.start <= end and start <= n.end:
+                add(n.i)
+
+            for child in (n.left, n.right):
+                if child is None:
+                    continue
+                if start > child.max:
+                    stats.pruned_max += 1
+                elif child.min > end:
+                    stats.pruned_min += 1
+                else:
+                    stack.append(child)
+            if len(stack) > max_stack:
+                max_stack = len(stack)
+
+        stats.hits += len(result)
+        if max_stack > stats.max_stack:
+            stats.max_stack = max_stack
+        return result
+
+    def iter_search(self, i, limit: Optional[int] = None,
+                    ordered: bool = False):
+        """Iterate over the overlapping instances of a given interval.
+
+        Unlike ``search``, the hits are produced as they are found, so a
+        consumer which stops early does not pay for the rest of the search.
+
+        :param i: an object with ``start`` and ``end`` attributes
+        :param limit: stop after this many hits
+        :param ordered: yield the hits in order of ``start``. The traversal
+            then also ends at the first node starting after the query.
+        :return: an iterator of interval objects
+        """
+        if ordered:
+            hits = self._iter_search_ordered(i.start, i.end)
+        else:
+            hits = self._iter_search(i.start, i.end)
+        if self._buckets:
+            hits = itertools.chain.from_iterable(hits)
+        return hits if limit is None else itertools.islice(hits, limit)
+
+    def _iter_search(self, start: int, end: int):
+        root = self.root
+        stack = [root] if root is not None else []
+        while stack:
+            n = stack.pop()
+            if n.start <= end and start <= n.end:
+                yield n.i
+
+            left, right = n.left, n.right
+            if left is not None and start <= left.max and left.min <= end:
+                stack.append(left)
+            if right is not None and start <= right.max and right.min <= end:
+                stack.append(right)
+
+    def _iter_search_ordered(self, start: int, end: int):
+        # An in-order traversal which skips subtrees that cannot overlap the
+        # interval.
+        stack = []
+        n = self.root
+        while stack or n is not None:
+            if n is not None:
+                if start <= n.max and n.min <= end:
+                    stack.append(n)
+                    n = n.left
+                else:
+                    n = None
+            else:
+                n = stack.pop()
+                if n.start > end:
+                    # this and every later node start after the interval
+                    return
+                if start <= n.end:
+                    yield n.i
+                n = n.right
+
+    def search_sorted(self, queries):
+        """Search for a stream of intervals sorted by ``start``.
+
+        Rather than searching from the root for every query, the tree is
+        traversed in order alongside runs of overlapping queries, keeping
+        the intervals which have started and not yet ended in a heap by
+        ``end``. A query which does not overlap its predecessor, or which
+        starts more than about log2(n) intervals further on, is searched
+        from the root instead, and the traversal resumes from the next
+        overlapping query. The total work is thus close to linear in the
+        number of queries and hits, plus one descent per isolated query,
+        which suits queries read from a coordinate-sorted file. The hits of each query are not in any
+        particular order.
+
+        :param queries: an iterable of objects with ``start`` and ``end``
+            attributes, sorted by ``start``
+        :return: an iterator of result lists, one per query, each containing
+            the same intervals as ``search`` would return
+        :raises ValueError: when a query starts before its predecessor
+        """
+        return _sweep_search(queries, lambda q: self._search(q.start, q.end),
+                             self._seek, len(self).bit_length())
+
+    def _seek(self, pos: int):
+        # The intervals containing pos and an iterator over those starting
+        # after it, for _sweep_search.
+        return self.search_point(pos), self._iter_after(pos)
+
+    def _iter_after(self, pos: int):
+        # The intervals starting after pos in order. The stack holds the
+        # nodes still to be visited, after a descent to the first of them.
+        stack = []
+        n = self.root
+        while n is not None:
+            if n.start > pos:
+                stack.append(n)
+                n = n.left
+            else:
+                n = n.right
+        buckets = self._buckets
+        while stack:
+            n = stack.pop()
+            if buckets:
+                yield from n.i
+            else:
+                yield n.i
+            n = n.right
+            while n is not None:
+                stack.append(n)
+                n = n.left
+
+    def search_many(self, starts, ends, threads: Optional[int] = None):
+        """Search for many intervals at once.
+
+        The whole batch is searched inside a single call, so there is no
+        need to construct a query object per interval.
+
+        The batch holds the tree's read lock, so ``insert``, ``remove`` and
+        the other mutating methods called from other threads wait until it
+        is finished and every query sees the same version of the tree.
+        Several batches may run at the same time. Single searches do not
+        take the lock; use ``snapshot`` to search a tree that is being
+        modified by another thread.
+
+        :param starts: a sequence or NumPy array of query starts
+        :param ends: a sequence or NumPy array of query ends, of the same
+            length as ``starts``
+        :param threads: split the queries into this many contiguous chunks
+            searched by a pool of threads. This only speeds up searches on
+            free-threaded builds of Python (3.13t and later), as otherwise
+            the threads take turns holding the global interpreter lock. The
+            result does not depend on the number of threads.
+        :return: a tuple ``(offsets, hits)`` in compressed sparse row form.
+            ``hits`` is a list of the overlapping interval objects and the
+            hits of the k-th query are ``hits[offsets[k]:offsets[k + 1]]``.
+        """
+        starts, ends = _as_sequence(starts), _as_sequence(ends)
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be of the same length.")
+
+        with self._lock.reading():
+            if threads is None or threads <= 1 or len(starts) < 2:
+                return self._search_many(starts, ends)
+            chunks = _chunk_bounds(len(starts), threads)
+            with ThreadPoolExecutor(len(chunks)) as pool:
+                parts = list(pool.map(
+                    lambda b: self._search_many(starts[b[0]:b[1]],
+                                                ends[b[0]:b[1]]),
+                    chunks))
+        return _concat_sparse(parts)
+
+    def _search_many(self, starts, ends):
+        offsets = array('q', [0])
+        hits = []
+        add = hits.extend if self._buckets else hits.append
+        root = self.root
+        for start, end in zip(starts, ends):
+            if root is not None:
+                stack = [root]
+                while stack:
+                    n = stack.pop()
+                    if n.start <= end and start <= n.end:
+                        add(n.i)
+                    left, right = n.left, n.right
+                    if left is not None and start <= left.max and \
+                            left.min <= end:
+                        stack.append(left)
+                    if right is not None and start <= right.max and \
+                            right.min <= end:
+                        stack.append(right)
+            offsets.append(len(hits))
+
+        return offsets, hits
+
+    def search_within(self, i):
+        """Return all intervals lying entirely within a given interval.
+
+        These are the intervals whose ``start`` and ``end`` are both between
+        ``i.start`` and ``i.end``. Unlike filtering the result of
+        ``search``, subtrees are skipped when they only start outside of
+        the query or all of their intervals end after it, so intervals
+        which merely overlap the query are mostly not visited.
+        """
+        start, end = i.start, i.end
+        result = []
+        add = result.extend if self._buckets else result.append
+        root = self.root
+        stack = [root] if root is not None else []
+        while stack:
+            n = stack.pop()
+            left, right = n.left, n.right
+            if start <= n.start:
+                if n.start <= end and start <= n.end <= end:
+                    add(n.i)
+                # the left subtree starts at or before this node, so it can
+                # only hold intervals within the query if this node does not
+                # start before it
+                if left is not None and left.min_end <= end and \
+                        start <= left.max:
+                    stack.append(left)
+            # likewise, the right subtree starts at or after this node
+            if n.start <= end and right is not None and \
+                    right.min_end <= end and start <= right.max:
+                stack.append(right)
+
+        return result
+
+    def search_enclosing(self, i):
+        """Return all intervals which entirely contain a given interval.
+
+        These are the intervals starting at or before ``i.start`` and
+        ending at or after ``i.end``. Subtrees are skipped when they only
+        start after the query or all of their intervals end before it.
+        """
+        start, end = i.start, i.end
+        result = []
+        add = result.extend if self._buckets else result.append
+        root = self.root
+        stack = [root] if root is not None else []
+        while stack:
+            n = stack.pop()
+            left = n.left
+            if n.start <= start:
+                if end <= n.end:
+                    add(n.i)
+                # the right subtree starts at or after this node, so it can
+                # only enclose the query if this node starts before it
+                right = n.right
+                if right is not None and end <= right.max and \
+                        right.min <= start:
+                    stack.append(right)
+            if left is not None and end <= left.max and left.min <= start:
+                stack.append(left)
+
+        return result
+
+    def search_point(self, pos: int):
+        """Return all intervals containing a single position.
+
+        This is equivalent to searching for an interval with ``start`` and
+        ``end`` both equal to ``pos`` but needs no query object.
+        """
+        result = []
+        add = result.extend if self._buckets else result.append
+        root = self.root
+        stack = [root] if root is not None else []
+        while stack:
+            n = stack.pop()
+            left = n.left
+            if n.start <= pos:
+                if pos <= n.end:
+                    add(n.i)
+                # the right subtree starts at or after this node, so it can
+                # only contain the position if this node starts before it
+                right = n.right
+                if right is not None and right.min <= pos <= right.max:
+                    stack.append(right)
+            if left is not None and left.min <= pos <= left.max:
+                stack.append(left)
+
+        return result
+
+    def search_points(self, positions):
+        """Return all intervals containing each of many positions.
+
+        :param positions: a sequence or NumPy array of positions
+        :return: a tuple ``(offsets, hits)`` as for ``search_many``: the
+            intervals containing the k-th position are
+            ``hits[offsets[k]:offsets[k + 1]]``.
+        """
+        offsets = array('q', [0])
+        hits = []
+        add = hits.extend if self._buckets else hits.append
+        root = self.root
+        for pos in _as_sequence(positions):
+            stack = [root] if root is not None else []
+            while stack:
+                n = stack.pop()
+                left = n.left
+                if n.start <= pos:
+                    if pos <= n.end:
+                        add(n.i)
+                    right = n.right
+                    if right is not None and \
+                            right.min <= pos <= right.max:
+                        stack.append(right)
+                if left is not None and left.min <= pos <= left.max:
+                    stack.append(left)
+            offsets.append(len(hits))
+
+        return offsets, hits
+
+    def overlaps(self, i) -> bool:
+        """Return whether any interval overlaps a given interval.
+
+        The search stops at the first overlapping interval.
+        """
+        return self._overlaps(i.start, i.end)
+
+    def _overlaps(self, start: int, end: int) -> bool:
+        root = self.root
+        stack = [root] if root is not None else []
+        while stack:
+            n = stack.pop()
+            if n.start <= end and start <= n.end:
+                return True
+
+            left, right = n.left, n.right
+            if left is not None and start <= left.max and left.min <= end:
+                stack.append(left)
+            if right is not None and start <= right.max and right.min <= end:
+                stack.append(right)
+
+        return False
+
+    def overlaps_many(self, starts, ends) -> List[bool]:
+        """Return whether anything overlaps each of many queries.
+
+        :param starts: a sequence or NumPy array of query starts
+        :param ends: a sequence or NumPy array of query ends, of the same
+            length as ``starts``
+        :return: a list of booleans, one per query
+        """
+        starts, ends = _as_sequence(starts), _as_sequence(ends)
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be of the same length.")
+
+        return [self._overlaps(start, end) for start, end in zip(starts, ends)]
+
+    def count(self, i) -> int:
+        """Return the number of intervals overlapping a given interval.
+
+        This is the length of ``search(i)`` but is computed in O(log n)
+        without visiting the overlapping intervals.
+        """
+        starts, ends = self._coordinates()
+        # every interval either overlaps, starts after the query ends or
+        # ends before the query starts
+        return bisect_right(starts, i.end) - bisect_left(ends, i.start)
+
+    def count_many(self, starts, ends) -> array:
+        """Return the number of overlapping intervals for many queries.
+
+        :param starts: a sequence or NumPy array of query starts
+        :param ends: a sequence or NumPy array of query ends, of the same
+            length as ``starts``
+        :return: an integer array of counts, one per query
+        """
+        starts, ends = _as_sequence(starts), _as_sequence(ends)
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be of the same length.")
+
+        tree_starts, tree_ends = self._coordinates()
+        return array('q', (
+            bisect_right(tree_starts, end) - bisect_left(tree_ends, start)
+            for start, end in zip(starts, ends)))
+
+    def _coordinates(self):
+        # The sorted starts and sorted ends of all intervals, used to count
+        # overlaps. They are built on first use and rebuilt on the first use
+        # after any mutation.
+        if self._coordinate_index is None or \
+                self._coordinate_index[0] != self._version:
+            starts = array('q', (i.start for i in self))
+            ends = array('q', sorted(i.end for i in self))
+            self._coordinate_index = (self._version, starts, ends)
+        return self._coordinate_index[1:]
+
+    def join(self, other):
+        """Iterate over all pairs of overlapping intervals of two trees.
+
+        Both trees are traversed once in order of ``start`` while keeping
+        the intervals which may still overlap, so the cost is linear in the
+        sizes of the trees and the number of pairs rather than one search
+        per interval.
+
+        :param other: an ``ITree``, ``FrozenITree`` or any iterable of
+            interval objects sorted by ``start``
+        :return: an iterator of ``(a, b)`` tuples with ``a`` from this tree
+            and ``b`` from ``other``
+        """
+        return _sweep_join(iter(self), iter(other))
+
+
+#: The statistics of a search result cache
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class _ReadWriteLock(object):
+    # A lock held either by any number of readers or by a single writer.
+    # The first reader to arrive takes the writer's lock on behalf of all
+    # readers and the last one to leave releases it. Readers are preferred:
+    # a reader never waits for a writer while other readers hold the lock,
+    # so a batch may start nested batches from its own threads.
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._readers = 0
+
+    def writing(self):
+        return self._write_lock
+
+    @contextlib.contextmanager
+    def reading(self):
+        with self._mutex:
+            self._readers += 1
+            if self._readers == 1:
+                self._write_lock.acquire()
+        try:
+            yield
+        finally:
+            with self._mutex:
+                self._readers -= 1
+                if not self._readers:
+                    self._write_lock.release()
+
+
+def _chunk_bounds(n: int, parts: int):
+    # Split range(n) into at most `parts` contiguous (lo, hi) ranges of
+    # nearly equal length.
+    step = -(-n // parts)
+    return [(lo, min(lo + step, n)) for lo in range(0, n, step)]
+
+
+def _concat_sparse(parts):
+    # Join the (offsets, hits) results of consecutive query chunks, shifting
+    # the offsets of each chunk by the number of hits before it.
+    offsets = array('q', [0])
+    hits = []
+    for part_offsets, part_hits in parts:
+        shift = len(hits)
+        offsets.extend(o + shift for o in part_offsets[1:])
+        hits.extend(part_hits)
+    return offsets, hits
+
+
+class _ResultCache(object):
+    # A bounded mapping of queries to search results which discards the
+    # least recently used entry when full. Each entry records the version of
+    # the tree it was computed from and is only returned for that version, so
+    # mutations need not clear the cache. Searches may run in several threads
+    # at once, so the entries and counters are guarded by a lock, which is
+    # only held for the lookup or update itself.
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, result):
+        with self._lock:
+            entries = self.entries
+            entries[key] = (version, result)
+            entries.move_to_end(key)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self.entries))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
+def _copy_node(n: ITreeNode) -> ITreeNode:
+    c = ITreeNode.__new__(ITreeNode)
+    c.i, c.start, c.end = n.i, n.start, n.end
+    c.left, c.right = n.left, n.right
+    c.min, c.max, c.height, c.size = n.min, n.max, n.height, n.size
+    c.min_end = n.min_end
+    return c
+
+
+def _copy_path(path: List[ITreeNode]) -> List[ITreeNode]:
+    # Copy a path of nodes in which each node is a child of the previous one,
+    # linking each copy to the copy of its child.
+    copies = [_copy_node(n) for n in path]
+    for parent, n, c in zip(copies, path[1:], copies[1:]):
+        if parent.left is n:
+            parent.left = c
+        else:
+            parent.right = c
+    return copies
+
+
+def _merge_buckets(nodes: List[ITreeNode]) -> List[ITreeNode]:
+    # Merge the buckets of consecutive nodes with the same coordinates in a
+    # sorted list of bucket nodes.
+    merged = []
+    for n in nodes:
+        if merged and merged[-1].start == n.start and merged[-1].end == n.end:
+            merged[-1].i.extend(n.i)
+        else:
+            merged.append(n)
+    return merged
+
+
+def _discard_from_bucket(bucket: list, i):
+    # Remove an interval object from a bucket, or any interval of the bucket
+    # if the object itself is not in it.
+    for k, obj in enumerate(bucket):
+        if obj is i:
+            del bucket[k]
+            return
+    bucket.pop()
+
+
+# The trees of the shared index file, loaded once by each worker process
+# of GroupedITree.search_many
+_worker_trees = []
+
+
+def _load_worker_index(path: str):
+    global _worker_trees
+    _, trees = read_index(path)
+    _worker_trees = [FrozenITree._from_columns(**columns) for columns in trees]
+
+
+def _search_worker_index(tree: int, starts, ends):
+    return _worker_trees[tree].search_many_indices(starts, ends)
+
 
 class GroupedITree(object):
-    def __init__(self, key, intervals=None):
+    def __init__(self, key, intervals=None, buckets: bool = False,
+                 cache_size: int = 0):
         """A collection of ITree objects partitioned by a key value
 
         :param key: either a string indicating the name of the attribute
             or a function to group the objects by
         :param intervals: an optional list of objects to initialize the ITrees with
+        :param buckets: keep duplicated intervals in a single node of each
+            tree. See ``ITree``.
+        :param cache_size: keep the results of up to this many distinct
+            ``search`` queries across all of the trees. See ``ITree``.
         """
 
         self._key_obj = key
@@ -381,28 +1561,532 @@ class GroupedITree(object):
         else:
             raise TypeError("key must be a string or a callable.")
 
+        # the index file shared with worker processes by search_many, and
+        # the pool of those processes
+        self._shared_index = None
+        self._pool = None
+        self._buckets = buckets
+        self._cache = _ResultCache(cache_size) if cache_size > 0 else None
+        self._stats_enabled = False
         self.trees = {}
         if intervals is not None:
+            # a single sort by (key, start, end) leaves every group ready for
+            # a balanced bulk build
             self.trees = {
-                k: ITree(nodes=list(grp))
+                k: ITree.from_intervals(grp, presorted=True, buckets=buckets)
                 for k, grp in itertools.groupby(
-                    sorted(intervals, key=self.key), key=self.key)
+                    sorted(intervals,
+                           key=lambda i: (self.key(i), i.start, i.end)),
+                    key=self.key)
             }
 
+    @classmethod
+    def from_bed(cls, path: str, mmap: bool = False,
+                 chunk_size: int = 1 << 20, buckets: bool = False,
+                 cache_size: int = 0):
+        """Load the intervals of a BED file grouped by chromosome.
+
+        The file is streamed in chunks into lightweight ``BedInterval``
+        records (with ``chrom``, ``start``, ``end`` and ``name``) and each
+        chromosome's tree is bulk-built as soon as the chromosome ends, so
+        only one chromosome's records are buffered at a time in a
+        chromosome-sorted file. Unsorted files are also supported: the
+        records of chromosomes which reappear are buffered, and each such
+        chromosome's tree is rebuilt once at the end of the file.
+
+        :param path: the path of the BED file
+        :param mmap: map the file into memory instead of reading it
+        :param chunk_size: the number of bytes to parse at a time
+        :param buckets: keep duplicated intervals in a single node of each
+            tree. See ``ITree``.
+        :param cache_size: the number of search results to cache
+        :return: a new ``GroupedITree`` keyed by ``chrom``
+        """
+        grouped = cls('chrom', buckets=buckets, cache_size=cache_size)
+        trees = grouped.trees
+        # the later records of chromosomes which reappear in an unsorted file
+        late = collections.defaultdict(list)
+
+        def build(chrom, records):
+            if chrom in trees:
+                late[chrom].extend(records)
+            else:
+                trees[chrom] = ITree.from_intervals(records, buckets=buckets)
+
+        chrom, records = None, []
+        for record in read_bed(path, mmap=mmap, chunk_size=chunk_size):
+            if record.chrom is not chrom:
+                if records:
+                    build(chrom, records)
+                chrom, records = record.chrom, []
+            records.append(record)
+        if records:
+            build(chrom, records)
+        for chrom, records in late.items():
+            trees[chrom] = ITree.from_intervals(list(trees[chrom]) + records,
+                                                buckets=buckets)
+
+        return grouped
+
+    def save(self, path: str, payload: bool = True):
+        """Save all of the trees to a single binary index file.
+
+        Keys must be strings or integers. If the grouping key is an
+        attribute name, it is saved as well. The payload of interval objects
+        is pickled, so files to be shared with others should be saved with
+        ``payload=False``. See ``FrozenITree.save``.
+        """
+        keys = list(self.trees)
+        write_index(path,
+                    [FrozenITree(self.trees[k]) for k in keys], keys=keys,
+                    key_name=self._key_obj if isinstance(self._key_obj, str)
+                    else None,
+                    payload=payload)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, key=None,
+             cache_size: int = 0):
+        """Load trees saved with ``save``.
+
+        Each tree is a read-only ``FrozenITree`` backed by the file's
+        columns, which supports every query of ``ITree``. Inserting into or
+        removing from the tree of a loaded key raises a ``TypeError``, while
+        intervals of new keys are inserted into new trees. A payload of
+        interval objects is unpickled, which can run arbitrary code, so only
+        load files from trusted sources. See ``FrozenITree.load``.
+
+        :param path: the path of the file to read
+        :param mmap: map the file into memory rather than reading it
+        :param key: the grouping key, required if it was not saved
+        :param cache_size: the number of search results to cache
+        :return: a ``GroupedITree``
+        """
+        header, trees = read_index(path, mmap=mmap)
+        if header['keys'] is None:
+            raise ValueError(f"{path} holds a single tree; use ITree.load "
+                             f"instead.")
+        key = key if key is not None else header['key']
+        if key is None:
+            raise ValueError(f"{path} does not record its key; pass key.")
+
+        grouped = cls(key, cache_size=cache_size)
+        grouped.trees = {
+            k: FrozenITree._from_columns(**columns)
+            for k, columns in zip(header['keys'], trees)
+        }
+        return grouped
+
     def __repr__(self):
         return f"GroupedITree(key={self._key_obj}, trees={self.trees})"
 
     def insert(self, i):
-        self.trees.setdefault(self.key(i), ITree()).insert(i)
+        k = self.key(i)
+        if k not in self.trees:
+            self._add_tree(k, ITree(buckets=self._buckets))
+        self._mutable_tree(k).insert(i)
+
+    def insert_many(self, intervals):
+        """Insert many intervals into the trees of their keys.
+
+        See ``ITree.insert_many``.
+        """
+        for k, grp in self._group(intervals):
+            if k in self.trees:
+                self._mutable_tree(k).insert_many(grp)
+            else:
+                self._add_tree(k, ITree.from_intervals(
+                    grp, buckets=self._buckets))
+
+    def _add_tree(self, k, tree: ITree):
+        # trees for new keys collect statistics like the existing ones
+        if self._stats_enabled:
+            tree.enable_stats()
+        self.trees[k] = tree
+
+    def _mutable_tree(self, k) -> ITree:
+        tree = self.trees[k]
+        if isinstance(tree, FrozenITree):
+            raise TypeError(f"the tree of key {k!r} is a read-only "
+                            f"FrozenITree.")
+        return tree
+
+    def remove_many(self, intervals) -> int:
+        """Remove many intervals from the trees of their keys.
+
+        See ``ITree.remove_many``.
+
+        :return: the number of intervals removed
+        """
+        return sum(self._mutable_tree(k).remove_many(grp)
+                   for k, grp in self._group(intervals) if k in self.trees)
+
+    def _group(self, intervals):
+        groups = collections.defaultdict(list)
+        for i in intervals:
+            groups[self.key(i)].append(i)
+        return groups.items()
 
     def search(self, i):
         k = self.key(i)
         if k not in self.trees:
             return []
+        tree = self.trees[k]
+        cache = self._cache
+        if cache is None:
+            return tree.search(i)
+
+        # frozen trees cannot change, so their version is constant
+        key = k, i.start, i.end
+        version = tree, getattr(tree, '_version', 0)
+        result = cache.get(key, version)
+        if result is None:
+            result = tree.search(i)
+            cache.put(key, version, result)
+        return list(result)
+
+    def cache_info(self):
+        """Return the statistics of the search result cache.
+
+        See ``ITree.cache_info``.
+        """
+        return self._cache.info() if self._cache is not None else None
+
+    def cache_clear(self):
+        """Empty the search result cache and reset its statistics"""
+        if self._cache is not None:
+            self._cache.clear()
+
+    def snapshot(self):
+        """Return a copy of the trees that later mutations do not affect.
+
+        Each ``ITree`` is copied in constant time with ``ITree.snapshot``,
+        which switches it to persistent mode. Frozen trees cannot change and
+        are shared.
+
+        :return: a new ``GroupedITree``
+        """
+        grouped = type(self)(self._key_obj, buckets=self._buckets)
+        grouped.trees = {
+            k: tree.snapshot() if isinstance(tree, ITree) else tree
+            for k, tree in self.trees.items()}
+        return grouped
+
+    def enable_stats(self):
+        """Start collecting statistics in every tree.
+
+        Frozen trees, e.g. those of a loaded index, are not instrumented.
+        See ``ITree.enable_stats``.
+        """
+        self._stats_enabled = True
+        for tree in self.trees.values():
+            if isinstance(tree, ITree):
+                tree.enable_stats()
+
+    def disable_stats(self):
+        """Stop collecting statistics in every tree"""
+        self._stats_enabled = False
+        for tree in self.trees.values():
+            if isinstance(tree, ITree):
+                tree.disable_stats()
+
+    @property
+    def stats(self) -> dict:
+        """The statistics of each key's tree since ``enable_stats``
+
+        Statistics of all keys can be combined with
+        ``sum(grouped.stats.values(), TreeStats())``.
+        """
+        return {k: tree.stats for k, tree in self.trees.items()
+                if getattr(tree, 'stats', None) is not None}
+
+    def search_many(self, queries, workers: Optional[int] = None,
+                    threads: Optional[int] = None):
+        """Search for many intervals at once.
+
+        Queries are grouped by key and each group is searched by its tree in
+        batches. With more than one worker, the batches are spread over a
+        pool of processes. The trees are not pickled for this: they are
+        written once to a temporary index file (see ``save``) which each
+        worker maps into memory, so only the query coordinates and the hit
+        indices are passed between processes. The file and the pool, whose
+        processes keep the trees loaded, are reused until one of the trees
+        changes or a different number of workers is requested. Call
+        ``close`` (or use the grouping in a ``with`` block) to stop the
+        workers; they are otherwise stopped once the grouping is garbage
+        collected.
+
+        With more than one thread, the batches are instead spread over a
+        pool of threads sharing the trees, which only speeds up searches on
+        free-threaded builds of Python. The read locks of all of the
+        searched trees are held until the whole call is finished, so every
+        query sees the same version of each tree, as for
+        ``ITree.search_many``.
+
+        :param queries: a sequence of interval objects
+        :param workers: the number of worker processes
+        :param threads: the number of worker threads. Cannot be combined
+            with ``workers``.
+        :return: a list with the result list of each query, in the order of
+            ``queries``
+        """
+        parallel = [n for n in (workers, threads) if n is not None and n > 1]
+        if len(parallel) > 1:
+            raise ValueError("workers and threads cannot both be used.")
+
+        groups = {}
+        for pos, q in enumerate(queries):
+            groups.setdefault(self.key(q), []).append(pos)
+
+        results = [[] for _ in queries]
+        batches = []
+        for k, positions in groups.items():
+            if k in self.trees:
+                batches.append((k, positions))
+
+        if not batches:
+            return results
+
+        def search_batch(k, positions):
+            # each batch writes to its own positions of results
+            tree = self.trees[k]
+            offsets, hits = tree.search_many(
+                [queries[pos].start for pos in positions],
+                [queries[pos].end for pos in positions])
+            for j, pos in enumerate(positions):
+                results[pos] = hits[offsets[j]:offsets[j + 1]]
+
+        if not parallel:
+            for k, positions in batches:
+                search_batch(k, positions)
+            return results
+
+        # split large groups so that the work is spread evenly
+        size = -(-sum(len(positions) for _, positions in batches) //
+                 (4 * parallel[0]))
+        batches = [(k, positions[lo:lo + size])
+                   for k, positions in batches
+                   for lo in range(0, len(positions), size)]
+
+        if threads is not None and threads > 1:
+            with contextlib.ExitStack() as stack:
+                for k in {k for k, _ in batches}:
+                    if isinstance(self.trees[k], ITree):
+                        stack.enter_context(self.trees[k]._lock.reading())
+                with ThreadPoolExecutor(threads) as pool:
+                    futures = [pool.submit(search_batch, k, positions)
+                               for k, positions in batches]
+                    for future in futures:
+                        future.result()
+            return results
+
+        path, trees = self._write_shared_index()
+        pool = self._worker_pool(path, workers)
+        futures = [
+            pool.submit(_search_worker_index, trees[k][0],
+                        [queries[pos].start for pos in positions],
+                        [queries[pos].end for pos in positions])
+            for k, positions in batches]
+        for (k, positions), future in zip(batches, futures):
+            offsets, hits = future.result()
+            # workers return the positions of the hits in the tree
+            tree = trees[k][1]
+            hits = [tree.intervals[tree.index[h]] for h in hits]
+            for j, pos in enumerate(positions):
+                results[pos] = hits[offsets[j]:offsets[j + 1]]
+
+        return results
+
+    def _worker_pool(self, path: str, workers: int) -> ProcessPoolExecutor:
+        # Return the pool of worker processes which have loaded the current
+        # shared index, starting a new one if there is none yet for this
+        # index and number of workers.
+        if self._pool is not None and \
+                self._pool[0] is self._shared_index and \
+                self._pool[1] == workers:
+            return self._pool[2]
+        self._close_pool()
+        pool = ProcessPoolExecutor(workers, initializer=_load_worker_index,
+                                   initargs=(path,))
+        shutdown = weakref.finalize(self, pool.shutdown, wait=False)
+        self._pool = (self._shared_index, workers, pool, shutdown)
+        return pool
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool[3]()
+            self._pool = None
+
+    def close(self):
+        """Stop the worker processes of ``search_many``.
+
+        The shared index file is removed as well. Later calls to
+        ``search_many`` with ``workers`` start new processes.
+        """
+        self._close_pool()
+        if self._shared_index is not None:
+            self._shared_index[3]()
+            self._shared_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_shared_index(self):
+        # Write the trees to a temporary index file for worker processes, or
+        # reuse the previous file if no tree has been replaced or modified.
+        # Returns the path and, for each key, the position of its tree in the
+        # file and the frozen tree whose rows were written.
+        state = [(k, id(tree), getattr(tree, '_version', None))
+                 for k, tree in self.trees.items()]
+        if self._shared_index is not None and \
+                self._shared_index[0] == state:
+            return self._shared_index[1:3]
+        if self._shared_index is not None:
+            # the workers have loaded the previous file
+            self._close_pool()
+            self._shared_index[3]()
+
+        trees = {k: (pos, tree if isinstance(tree, FrozenITree)
+                     else FrozenITree(tree))
+                 for pos, (k, tree) in enumerate(self.trees.items())}
+        fd, path = tempfile.mkstemp(suffix='.idx')
+        os.close(fd)
+        remove = weakref.finalize(self, os.remove, path)
+        write_index(path, [tree for _, tree in trees.values()],
+                    payload=False)
+        self._shared_index = (state, path, trees, remove)
+        return path, trees
+
+    def iter_search(self, i, limit: Optional[int] = None,
+                    ordered: bool = False):
+        """Iterate over the overlapping instances of a given interval.
+
+        See ``ITree.iter_search``.
+        """
+        k = self.key(i)
+        if k not in self.trees:
+            return iter(())
         else:
-            return self.trees[k].search(i)
+            return self.trees[k].iter_search(i, limit=limit, ordered=ordered)
+
+    def search_within(self, i):
+        """Return all intervals of the same key lying within an interval.
+
+        See ``ITree.search_within``.
+        """
+        k = self.key(i)
+        return self.trees[k].search_within(i) if k in self.trees else []
+
+    def search_enclosing(self, i):
+        """Return all intervals of the same key containing an interval.
+
+        See ``ITree.search_enclosing``.
+        """
+        k = self.key(i)
+        return self.trees[k].search_enclosing(i) if k in self.trees else []
 
     def remove(self, i):
+        """Remove an interval from the tree of its key
+
+        :raises KeyError: if there is no matching interval
+        """
+        k = self.key(i)
+        if k not in self.trees:
+            raise KeyError(f"no intervals with key {k!r}")
+        self._mutable_tree(k).remove(i)
+
+    def discard(self, i):
+        """Remove an interval from the tree of its key if it is present"""
         k = self.key(i)
         if k in self.trees:
-            self.trees[k].remove(i)
+            self._mutable_tree(k).discard(i)
+
+    def __contains__(self, i):
+        k = self.key(i)
+        return k in self.trees and i in self.trees[k]
+
+    def overlaps(self, i) -> bool:
+        """Return whether any interval overlaps a given interval"""
+        k = self.key(i)
+        return k in self.trees and self.trees[k].overlaps(i)
+
+    def overlaps_many(self, queries) -> List[bool]:
+        """Return whether anything overlaps each of many queries.
+
+        :param queries: a sequence of interval objects
+        :return: a list of booleans, in the order of ``queries``
+        """
+        trees = self.trees
+        mask = []
+        for q in queries:
+            tree = trees.get(self.key(q))
+            mask.append(tree is not None and tree._overlaps(q.start, q.end))
+        return mask
+
+    def search_sorted(self, queries):
+        """Search for a stream of intervals sorted by key and ``start``.
+
+        Consecutive queries with the same key are passed to that key's
+        ``ITree.search_sorted``, so a chromosome-sorted stream is swept
+        through each tree once. A key which reappears later in the stream
+        starts a new sweep.
+
+        :param queries: an iterable of interval objects
+        :return: an iterator of result lists, one per query
+        :raises ValueError: when a query starts before its predecessor with
+            the same key
+        """
+        for k, group in itertools.groupby(queries, key=self.key):
+            if k in self.trees:
+                yield from self.trees[k].search_sorted(group)
+            else:
+                for _ in group:
+                    yield []
+
+    def join(self, other):
+        """Iterate over all pairs of overlapping intervals of two groupings.
+
+        Only intervals with the same key are paired. See ``ITree.join``.
+
+        :param other: a ``GroupedITree``
+        :return: an iterator of ``(a, b)`` tuples with ``a`` from this
+            grouping and ``b`` from ``other``
+        """
+        for k, tree in self.trees.items():
+            if k in other.trees:
+                yield from tree.join(other.trees[k])
+
+    def count(self, i) -> int:
+        """Return the number of intervals overlapping a given interval"""
+        k = self.key(i)
+        if k not in self.trees:
+            return 0
+        else:
+            return self.trees[k].count(i)
+
+    def count_many(self, queries) -> array:
+        """Return the number of overlapping intervals for many queries.
+
+        Queries are grouped by key and each group is counted by its tree
+        in a single batch.
+
+        :param queries: a sequence of interval objects
+        :return: an integer array of counts, in the order of ``queries``
+        """
+        counts = array('q', bytes(8 * len(queries)))
+        groups = {}
+        for pos, q in enumerate(queries):
+            groups.setdefault(self.key(q), []).append(pos)
+
+        for k, positions in groups.items():
+            if k not in self.trees:
+                continue
+            group_counts = self.trees[k].count_many(
+                [queries[pos].start for pos in positions],
+                [queries[pos].end for pos in positions])
+            for pos, c in zip(positions, group_counts):
+                counts[pos] = c
+
+        return counts
@@ -0,0 +1,436 @@
+"""
+Log-structured interval tree for bursts of insertions.
+"""
+import collections
+import itertools
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .itree import ITree, _merge_buckets
+
+"""
+
+An ``LSMITree`` never rebalances a tree on insertion. New intervals are put
+into a small buffer kept sorted by (start, end), and once the buffer is full
+it is bulk-built into an ``ITree`` (with buckets) which is never modified
+again, called a level. Levels are ordered from the oldest to the newest and
+fall into tiers by size: a level of tier t holds fewer than
+buffer_size * size_ratio ** (t + 1) intervals. With a size ratio of 4:
+
+    levels    [ 20480 ]  [ 4096 ]  [ 4096 ]  [ 1024 ]      buffer  [ 37 ]
+    tier          2          1         1         0
+
+Whenever size_ratio levels are of the same tier, they are merged into a
+single level of the next tier. The intervals of every level are
+already in order, so a merge is a linear pass followed by a bulk build, and
+each interval is merged O(log n) times over the life of the tree. Searches
+consult the buffer and every level, of which there are O(log n).
+
+Intervals in the buffer are removed directly. Intervals in a level are
+instead marked by a tombstone, which keeps the removed interval object under
+its (start, end) pair, and searches skip exactly those objects. Like the
+buckets of ``ITree``, a removal prefers the object it was given over other
+intervals with the same coordinates. Tombstones are cleared when the levels
+holding their intervals are merged, and all levels are merged once there are
+as many tombstones as the buffer holds intervals.
+"""
+
+
+class LSMITree(object):
+    """Interval tree for workloads of bursts of insertions between queries.
+
+    Inserting into the buffer costs a binary search, and the intervals are
+    only built into a tree, in bulk, once the buffer is full. Bursts of
+    insertions are therefore cheaper than for ``ITree``, particularly when
+    the levels are merged in the background. Searches return the same
+    intervals as ``ITree.search`` but visit every level, so they are a few
+    times slower.
+
+    With ``background`` set, the levels are merged by a separate thread while
+    the tree is used. All methods may be called from several threads: they
+    hold the tree's lock, which the merging thread only takes to swap the
+    merged levels in. An exception raised by a background merge is raised
+    again when levels are next merged, at the latest by ``compact``. The
+    merging thread is stopped by ``close``, or on leaving a ``with`` block:
+
+        with LSMITree(background=True) as tree:
+            tree.insert_many(intervals)
+    """
+
+    def __init__(self, intervals=None, buffer_size: int = 1024,
+                 size_ratio: int = 4, background: bool = False):
+        """Initialize a log-structured interval tree.
+
+        :param intervals: an iterable of interval objects, which are built
+            into the first level at once
+        :param buffer_size: the number of intervals inserted into the
+            buffer before it is built into a level
+        :param size_ratio: merge this many levels of similar size at once
+        :param background: merge levels in a separate thread rather than
+            during the insertion which fills the buffer
+        """
+        if buffer_size < 1 or size_ratio < 2:
+            raise ValueError("buffer_size must be positive and size_ratio "
+                             "at least 2.")
+        self.buffer_size = buffer_size
+        self.size_ratio = size_ratio
+        self._buffer = []
+        self._buffer_keys = []
+        # the largest end - start in the buffer, which bounds the buffer
+        # intervals a search needs to check
+        self._buffer_span = 0
+        self._levels = []
+        # the removed interval objects of the levels by (start, end)
+        self._tombstones = {}
+        self._dead = 0
+        self._lock = threading.Lock()
+        self._merger = ThreadPoolExecutor(1) if background else None
+        self._merging = None
+        if intervals is not None:
+            level = ITree.from_intervals(intervals, buckets=True,
+                                         persistent=background)
+            if len(level):
+                self._levels.append(level)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop merging levels in the background.
+
+        Waits for any merge in progress. The tree may still be used, and its
+        levels are then merged during insertions and removals.
+        """
+        with self._lock:
+            merger, self._merger = self._merger, None
+        if merger is not None:
+            merger.shutdown(wait=True)
+            self._check_merging()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buffer) + \
+                sum(len(level) for level in self._levels) - self._dead
+
+    def __repr__(self):
+        with self._lock:
+            levels = [len(level) for level in self._levels]
+            return f"LSMITree(levels={levels}, buffer={len(self._buffer)}, " \
+                f"tombstones={self._dead})"
+
+    def __iter__(self):
+        """Iterate over the contained interval objects in order of ``start``"""
+        with self._lock:
+            intervals = _skip_removed(itertools.chain(*self._levels),
+                                      self._tombstones)
+            intervals.extend(self._buffer)
+        intervals.sort(key=lambda i: (i.start, i.end))
+        return iter(intervals)
+
+    def insert(self, i):
+        """Insert an interval into the tree.
+
+        :param i: an object with a ``start`` and ``end`` attribute or
+            property
+        """
+        key = (i.start, i.end)
+        with self._lock:
+            k = bisect_right(self._buffer_keys, key)
+            self._buffer_keys.insert(k, key)
+            self._buffer.insert(k, i)
+            self._buffer_span = max(self._buffer_span, i.end - i.start)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def insert_many(self, intervals):
+        """Insert many intervals into the tree.
+
+        The intervals are added to the buffer, which is built into a level
+        if it is then full.
+
+        :param intervals: an iterable of interval objects
+        """
+        intervals = list(intervals)
+        if not intervals:
+            return
+        with self._lock:
+            self._buffer.extend(intervals)
+            self._buffer.sort(key=lambda i: (i.start, i.end))
+            self._buffer_keys = [(i.start, i.end) for i in self._buffer]
+            self._buffer_span = max(self._buffer_span,
+                                    max(i.end - i.start for i in intervals))
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def remove(self, i):
+        """Remove an interval from the tree.
+
+        An interval with identical start and end must be present in the
+        tree, though it need not be the same object. If several intervals
+        match, only one of them is removed: the given object itself if it is
+        in the tree, as for ``ITree``.
+
+        :raises KeyError: if there is no matching interval
+        """
+        if not self._remove(i):
+            raise KeyError(f"no interval ({i.start},{i.end}) in the tree")
+
+    def discard(self, i):
+        """Remove an interval from the tree if it is present
+
+        Like ``remove``, but does nothing if there is no matching interval.
+        """
+        self._remove(i)
+
+    def __contains__(self, i):
+        """Whether an interval with identical start and end is in the tree"""
+        key = (i.start, i.end)
+        with self._lock:
+            k = bisect_left(self._buffer_keys, key)
+            if k < len(self._buffer_keys) and self._buffer_keys[k] == key:
+                return True
+            return self._find_in_levels(key, None) is not None
+
+    def _remove(self, i) -> bool:
+        key = (i.start, i.end)
+        with self._lock:
+            keys = self._buffer_keys
+            lo = bisect_left(keys, key)
+            hi = bisect_right(keys, key, lo)
+            k = next((k for k in range(lo, hi) if self._buffer[k] is i), None)
+            removed = None
+            if k is None:
+                removed = self._find_in_levels(key, i)
+                if removed is not i and lo < hi:
+                    # the most recently inserted, as ITree's buckets do
+                    k = hi - 1
+            if k is not None:
+                del keys[k]
+                del self._buffer[k]
+                return True
+            if removed is None:
+                return False
+            self._tombstones.setdefault(key, []).append(removed)
+            self._dead += 1
+            if self._dead >= self.buffer_size:
+                self._schedule_merges()
+            return True
+
+    def _find_in_levels(self, key, i):
+        # Return the interval of the levels to remove for i: i itself if it
+        # is in a level and not yet removed, and otherwise any interval with
+        # the given coordinates which is not yet removed, or None. Levels
+        # keep such intervals in a single bucket.
+        removed = list(self._tombstones.get(key, ()))
+        found = None
+        for level in self._levels:
+            path = level._find_path(*key)
+            if path is None:
+                continue
+            for obj in path[-1].i:
+                if _pop_identical(removed, obj):
+                    continue
+                if obj is i:
+                    return obj
+                found = obj
+        return found
+
+    def search(self, i):
+        """Return all overlapping instances of a given interval.
+
+        The interval need not be of the same class but is required to have
+        a ``start`` and ``end`` attribute or parameter.
+        """
+        start, end = i.start, i.end
+        with self._lock:
+            # the buffer is sorted, so only the intervals starting between
+            # start - span and end may overlap the query
+            keys = self._buffer_keys
+            lo = bisect_left(keys, (start - self._buffer_span,))
+            hi = bisect_right(keys, (end, float('inf')), lo)
+            result = [b for b in self._buffer[lo:hi] if start <= b.end]
+            if not self._tombstones:
+                for level in self._levels:
+                    result.extend(level._search(start, end))
+                return result
+            hits = []
+            for level in self._levels:
+                hits.extend(level._search(start, end))
+            result.extend(_skip_removed(hits, self._tombstones))
+        return result
+
+    def compact(self):
+        """Build the buffer and all levels into a single level.
+
+        All tombstones are cleared. With ``background`` set, this waits for
+        any merge in progress.
+        """
+        if self._merging is not None:
+            wait([self._merging])
+        with self._lock:
+            self._check_merging()
+            levels = self._levels + [self._buffer_level()]
+            self._clear_buffer()
+            merged, _ = _merge_levels(levels, self._tombstones,
+                                      self._merger is not None)
+            self._levels = [merged] if len(merged) else []
+            self._tombstones = {}
+            self._dead = 0
+
+    def _flush(self):
+        # Build the buffer into the newest level. Called with the lock held.
+        self._levels.append(self._buffer_level())
+        self._clear_buffer()
+        self._schedule_merges()
+
+    def _buffer_level(self):
+        return ITree.from_intervals(self._buffer, presorted=True,
+                                    buckets=True,
+                                    persistent=self._merger is not None)
+
+    def _clear_buffer(self):
+        self._buffer, self._buffer_keys = [], []
+        self._buffer_span = 0
+
+    def _tier(self, level) -> int:
+        tier, size = 0, self.buffer_size * self.size_ratio
+        while len(level) >= size:
+            tier += 1
+            size *= self.size_ratio
+        return tier
+
+    def _pick_merge(self):
+        # Return the levels that should be merged next, or None. Levels need
+        # not be consecutive: their order does not matter to searches, and
+        # background merges leave levels of lower tiers after their result.
+        levels = self._levels
+        if self._dead >= self.buffer_size and levels:
+            return list(levels)
+        tiers = collections.defaultdict(list)
+        for level in levels:
+            tiers[self._tier(level)].append(level)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.size_ratio:
+                return tiers[tier][:self.size_ratio]
+        return None
+
+    def _schedule_merges(self):
+        # Called with the lock held.
+        if self._merger is None:
+            merge = self._pick_merge()
+            while merge is not None:
+                self._swap(merge, *_merge_levels(merge, self._tombstones,
+                                                 False))
+                merge = self._pick_merge()
+        elif self._merging is None or self._merging.done():
+            self._check_merging()
+            if self._pick_merge() is not None:
+                self._merging = self._merger.submit(self._merge_pending)
+
+    def _check_merging(self):
+        # Raise the exception of a finished background merge, once.
+        merging = self._merging
+        if merging is not None and merging.done():
+            self._merging = None
+            if merging.exception() is not None:
+                raise merging.exception()
+
+    def _merge_pending(self):
+        # Merge levels in the background until none need to be merged. The
+        # merged level is built without holding the lock.
+        while True:
+            with self._lock:
+                merge = self._pick_merge()
+                if merge is None:
+                    return
+                tombstones = {key: list(removed) for key, removed
+                              in self._tombstones.items()}
+            merged, applied = _merge_levels(merge, tombstones, True)
+            with self._lock:
+                self._swap(merge, merged, applied)
+
+    def _swap(self, merge, merged, applied):
+        # Replace the merged levels with the result and drop the tombstones
+        # applied by the merge. The levels are compared by identity, as
+        # ``compact`` may have replaced them while they were merged.
+        # Called with the lock held.
+        positions = [k for k, level in enumerate(self._levels)
+                     if any(level is m for m in merge)]
+        if len(positions) != len(merge):
+            return
+        levels = [level for k, level in enumerate(self._levels)
+                  if k not in positions]
+        if len(merged):
+            levels.insert(positions[0], merged)
+        self._levels = levels
+        for key, objs in applied.items():
+            removed = self._tombstones[key]
+            for obj in objs:
+                _pop_identical(removed, obj)
+            if not removed:
+                del self._tombstones[key]
+            self._dead -= len(objs)
+
+
+def _pop_identical(objs: list, i) -> bool:
+    # Remove an occurrence of the object i itself from a list, returning
+    # whether there was one.
+    for k, obj in enumerate(objs):
+        if obj is i:
+            del objs[k]
+            return True
+    return False
+
+
+def _skip_removed(intervals, tombstones):
+    # Drop the removed interval objects, each as many times as it was
+    # removed.
+    pending = {}
+    kept = []
+    for i in intervals:
+        key = (i.start, i.end)
+        if key in tombstones:
+            removed = pending.setdefault(key, list(tombstones[key]))
+            if _pop_identical(removed, i):
+                continue
+        kept.append(i)
+    return kept
+
+
+def _merge_levels(levels, tombstones, persistent):
+    # Merge levels into one, dropping the intervals removed by tombstones.
+    # Return the new level and the tombstones which were applied. The nodes
+    # of the levels are reused unless they may still be searched, in which
+    # case the levels are persistent and their nodes are copied.
+    nodes = []
+    for level in levels:
+        nodes.extend(level._detached_nodes())
+    # the nodes of each level are in order, so the sort merges sorted runs
+    nodes.sort(key=lambda n: (n.start, n.end))
+    nodes = _merge_buckets(nodes)
+    applied = {}
+    if tombstones:
+        kept = []
+        for n in nodes:
+            removed = tombstones.get((n.start, n.end))
+            if removed:
+                removed = list(removed)
+                bucket, dropped = [], []
+                for i in n.i:
+                    if _pop_identical(removed, i):
+                        dropped.append(i)
+                    else:
+                        bucket.append(i)
+                if dropped:
+                    applied[n.start, n.end] = dropped
+                    n.i = bucket
+            if n.i:
+                kept.append(n)
+        nodes = kept
+    merged = ITree(buckets=True, persistent=persistent)
+    merged._rebuild(nodes)
+    return merged, applied
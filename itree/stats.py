@@ -0,0 +1,61 @@
+"""
+Counters collected by interval trees with statistics enabled.
+"""
+
+
+class TreeStats(object):
+    """Operation counters of an interval tree.
+
+    Statistics are collected after ``ITree.enable_stats`` is called. Only
+    ``search`` queries which traverse the tree are counted (not those
+    answered by the result cache), so ``visited`` can be compared with
+    ``hits`` to judge how much work a query costs beyond its output.
+    Statistics of several trees can be added together.
+    """
+
+    __slots__ = ('searches', 'visited', 'pruned_min', 'pruned_max', 'hits',
+                 'max_stack', 'inserts', 'removes', 'rebuilds', 'rotations')
+
+    def __init__(self):
+        #: The number of searches which traversed the tree
+        self.searches: int = 0
+        #: The number of nodes visited by the searches
+        self.visited: int = 0
+        #: The number of subtrees skipped because they start after the query
+        self.pruned_min: int = 0
+        #: The number of subtrees skipped because they end before the query
+        self.pruned_max: int = 0
+        #: The number of intervals returned by the searches
+        self.hits: int = 0
+        #: The largest number of subtrees waiting to be visited by a search
+        self.max_stack: int = 0
+        #: The number of intervals inserted one at a time
+        self.inserts: int = 0
+        #: The number of intervals removed one at a time
+        self.removes: int = 0
+        #: The number of times the whole tree was rebuilt by a batch method
+        self.rebuilds: int = 0
+        #: The number of rotations performed to rebalance the tree
+        self.rotations: int = 0
+
+    def __add__(self, other):
+        total = TreeStats()
+        for name in self.__slots__:
+            combine = max if name == 'max_stack' else int.__add__
+            setattr(total, name,
+                    combine(getattr(self, name), getattr(other, name)))
+        return total
+
+    def __eq__(self, other):
+        return isinstance(other, TreeStats) and \
+            all(getattr(self, name) == getattr(other, name)
+                for name in self.__slots__)
+
+    def __repr__(self):
+        return "TreeStats(" + ",".join(
+            f"{name}={getattr(self, name)}" for name in self.__slots__) + ")"
+
+    @property
+    def visited_per_hit(self) -> float:
+        """The average number of nodes visited per returned interval"""
+        return self.visited / self.hits if self.hits else float('inf')
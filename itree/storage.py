@@ -0,0 +1,144 @@
+"""
+Binary on-disk format for frozen interval trees.
+"""
+import json
+import mmap as _mmap
+import pickle
+import sys
+from array import array
+from typing import List, Optional, Tuple
+
+"""
+
+An index file holds one or more ``FrozenITree`` objects, e.g. one per
+chromosome of a ``GroupedITree``, as a set of int64 columns:
+
+    offset  size  content
+    0       8     magic bytes b'ITREEIDX'
+    8       4     format version (uint32)
+    12      4     reserved
+    16      8     header length H (uint64)
+    24      H     JSON header, padded with spaces to a multiple of 8 bytes
+    24 + H  8N    starts  \
+            8N    ends     |
+            8N    mins     |  one int64 per interval, in the native byte
+            8N    maxs     |  order recorded in the header
+            8N    index   /
+            P     optional pickled list of each tree's interval objects
+
+All of the trees are stored back to back in each column. The header lists
+the keys of the trees and the offsets at which each tree's rows begin, so
+the k-th tree occupies rows offsets[k] to offsets[k + 1] of every column.
+Loading maps the file into memory and wraps each tree's rows in memoryviews,
+so a load does not copy or parse the columns and processes loading the same
+file share its pages through the page cache.
+"""
+
+MAGIC = b'ITREEIDX'
+VERSION = 1
+COLUMNS = ('starts', 'ends', 'mins', 'maxs', 'index')
+_PREAMBLE = 24
+
+
+def write_index(path: str, trees, keys: Optional[list] = None,
+                key_name: Optional[str] = None, payload: bool = True):
+    """Write frozen interval trees to an index file.
+
+    :param path: the path of the file to write
+    :param trees: a list of ``FrozenITree`` objects
+    :param keys: the keys of the trees, if they are grouped. Keys must be
+        strings or integers.
+    :param key_name: the name of the attribute the trees are grouped by
+    :param payload: also store the interval objects by pickling them. If
+        ``False``, the loaded trees return ``Interval`` records instead.
+    """
+    if keys is not None and \
+            not all(isinstance(k, (str, int)) for k in keys):
+        raise TypeError("only string and integer keys can be saved.")
+
+    offsets = [0]
+    for tree in trees:
+        offsets.append(offsets[-1] + len(tree))
+    header = {
+        'byteorder': sys.byteorder,
+        'count': offsets[-1],
+        'keys': keys,
+        'key': key_name,
+        'offsets': offsets,
+        'payload': payload,
+    }
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(VERSION.to_bytes(4, 'little'))
+        f.write(bytes(4))
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for column in COLUMNS:
+            for tree in trees:
+                if column == 'index' and not payload:
+                    # without the objects, intervals are numbered in the
+                    # order in which they are stored
+                    f.write(_int64_bytes(range(len(tree))))
+                else:
+                    f.write(_int64_bytes(getattr(tree, column)))
+        if payload:
+            pickle.dump([list(tree.intervals) for tree in trees], f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_index(path: str, mmap: bool = True) -> Tuple[dict, List[dict]]:
+    """Read the columns of an index file.
+
+    :param path: the path of the file to read
+    :param mmap: map the file into memory rather than reading it
+    :return: the header and, for each tree, a dictionary of its columns as
+        int64 memoryviews and its list of interval objects (or ``None``)
+    """
+    with open(path, 'rb') as f:
+        if mmap:
+            buffer = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        else:
+            buffer = f.read()
+
+    view = memoryview(buffer)
+    if bytes(view[:8]) != MAGIC:
+        raise ValueError(f"{path} is not an interval tree index.")
+    version = int.from_bytes(view[8:12], 'little')
+    if version != VERSION:
+        raise ValueError(f"{path} has unsupported format version {version}.")
+    header_length = int.from_bytes(view[16:24], 'little')
+    header = json.loads(bytes(view[_PREAMBLE:_PREAMBLE + header_length]))
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f"{path} was written with {header['byteorder']} "
+                         f"endian byte order.")
+
+    count, offsets = header['count'], header['offsets']
+    position = _PREAMBLE + header_length
+    columns = {}
+    for column in COLUMNS:
+        columns[column] = view[position:position + 8 * count].cast('q')
+        position += 8 * count
+
+    if header['payload']:
+        # unpickling runs code chosen by whoever wrote the file
+        payloads = pickle.loads(view[position:])
+    else:
+        payloads = [None] * (len(offsets) - 1)
+
+    trees = [
+        dict({column: values[lo:hi] for column, values in columns.items()},
+             intervals=intervals)
+        for lo, hi, intervals in zip(offsets, offsets[1:], payloads)
+    ]
+    return header, trees
+
+
+def _int64_bytes(values) -> bytes:
+    # memoryviews and arrays of int64 can be written as they are
+    if getattr(values, 'format', None) == 'q' or \
+            getattr(values, 'typecode', None) == 'q':
+        return bytes(values)
+    return array('q', values).tobytes()
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+import itree
+
+
+@pytest.fixture
+def bed_file(data_dir):
+    return os.path.join(data_dir, 'genes.mcl1.short.bed')
+
+
+@pytest.mark.bed
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize("chunk_size", [7, 1 << 20])
+def test_read_bed(bed_file, gene_intervals_short, mmap, chunk_size):
+    records = list(itree.read_bed(bed_file, mmap=mmap, chunk_size=chunk_size))
+
+    assert [(r.chrom, r.start, r.end) for r in records] == \
+        [(n.annotation, n.start, n.end) for n in gene_intervals_short]
+    assert records[0].name == 'bookends_p5.Chr10.g1.t1'
+
+
+@pytest.mark.bed
+def test_read_bed_headers_and_short_lines(tmp_path):
+    path = tmp_path / 'test.bed'
+    path.write_text('track name=test\n# comment\nchr1\t5\t10\n\nchr2 1 3 a\n')
+
+    assert list(itree.read_bed(str(path))) == [
+        itree.BedInterval('chr1', 5, 10), itree.BedInterval('chr2', 1, 3, 'a')]
+
+
+@pytest.mark.bed
+def test_read_empty_bed(tmp_path):
+    path = tmp_path / 'empty.bed'
+    path.write_text('')
+
+    assert list(itree.read_bed(str(path), mmap=True)) == []
+
+
+@pytest.mark.bed
+def test_grouped_itree_from_bed(FakeGroupedITree, bed_file,
+                                gene_intervals_short):
+    tree = itree.GroupedITree.from_bed(bed_file)
+    fake_tree = FakeGroupedITree(key='annotation',
+                                 intervals=gene_intervals_short)
+
+    for search in gene_intervals_short:
+        query = itree.BedInterval(search.annotation, search.start, search.end)
+        assert sorted((r.start, r.end) for r in tree.search(query)) == \
+            sorted((r.start, r.end) for r in fake_tree.search(search))
+
+
+@pytest.mark.bed
+def test_grouped_itree_from_unsorted_bed(tmp_path):
+    path = tmp_path / 'unsorted.bed'
+    path.write_text('chr1\t5\t10\nchr2\t1\t3\nchr1\t1\t2\nchr1\t8\t9\n')
+    tree = itree.GroupedITree.from_bed(str(path))
+
+    assert sorted(tree.trees) == ['chr1', 'chr2']
+    assert [(r.start, r.end) for r in tree.trees['chr1']] == \
+        [(1, 2), (5, 10), (8, 9)]
+    assert tree.count(itree.BedInterval('chr1', 9, 20)) == 2
+
+
+@pytest.mark.bed
+def test_grouped_itree_from_alternating_bed(tmp_path, monkeypatch):
+    path = tmp_path / 'alternating.bed'
+    path.write_text(''.join(f'chr{k % 2}\t{k}\t{k + 5}\n'
+                            for k in range(100)))
+    builds = []
+    from_intervals = itree.ITree.from_intervals.__func__
+    monkeypatch.setattr(itree.ITree, 'from_intervals', classmethod(
+        lambda cls, intervals, **kwargs: builds.append(len(intervals)) or
+        from_intervals(cls, intervals, **kwargs)))
+    tree = itree.GroupedITree.from_bed(str(path))
+
+    # each chromosome is built for its first run of records and once more
+    # at the end, rather than once per run
+    assert builds == [1, 1, 50, 50]
+    assert [r.start for r in tree.trees['chr1']] == list(range(1, 100, 2))
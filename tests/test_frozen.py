@@ -0,0 +1,113 @@
+import pytest
+import itree
+
+
+@pytest.mark.frozen_itree
+def test_frozen_search(FakeITree, itree_random_intervals, itree_random_queries):
+    tree = itree.FrozenITree(itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+
+    assert len(tree) == len(mock_tree)
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(mock_tree.search(search))
+
+
+@pytest.mark.frozen_itree
+def test_frozen_from_itree(itree_complex_sample):
+    tree = itree.ITree(nodes=itree_complex_sample)
+    frozen = itree.FrozenITree(tree)
+
+    assert list(frozen) == list(tree)
+    for search in itree_complex_sample:
+        assert sorted(frozen.search(search)) == sorted(tree.search(search))
+
+
+@pytest.mark.frozen_itree
+def test_frozen_augmentation(itree_simple_sample):
+    tree = itree.FrozenITree(itree_simple_sample)
+    root = len(tree) // 2
+
+    assert list(tree.starts) == sorted(n.start for n in itree_simple_sample)
+    assert tree.mins[root] == min(n.start for n in itree_simple_sample)
+    assert tree.maxs[root] == max(n.end for n in itree_simple_sample)
+    assert [tree.intervals[k] for k in tree.index] == list(tree)
+
+
+@pytest.mark.frozen_itree
+def test_frozen_search_within_enclosing(itree_random_intervals,
+                                        itree_random_queries):
+    tree = itree.FrozenITree(itree_random_intervals)
+    reference = itree.ITree.from_intervals(itree_random_intervals)
+
+    for search in itree_random_queries:
+        assert sorted(tree.search_within(search)) == \
+            sorted(reference.search_within(search))
+        assert sorted(tree.search_enclosing(search)) == \
+            sorted(reference.search_enclosing(search))
+    assert itree.FrozenITree().search_within(search) == []
+    assert itree.FrozenITree().search_enclosing(search) == []
+
+
+@pytest.mark.frozen_itree
+def test_frozen_search_empty(FakeNode):
+    tree = itree.FrozenITree()
+
+    assert len(tree) == 0
+    assert tree.search(FakeNode(3, 15)) == []
+
+
+@pytest.mark.frozen_itree
+def test_frozen_search_many(FakeITree, itree_random_intervals,
+                            itree_random_queries):
+    tree = itree.FrozenITree(itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+    offsets, hits = tree.search_many([q.start for q in itree_random_queries],
+                                     [q.end for q in itree_random_queries])
+
+    indices = tree.search_many_indices(
+        [q.start for q in itree_random_queries],
+        [q.end for q in itree_random_queries])
+
+    assert len(offsets) == len(itree_random_queries) + 1
+    assert indices[0] == offsets
+    for k, search in enumerate(itree_random_queries):
+        found = hits[offsets[k]:offsets[k + 1]]
+        assert sorted(found) == sorted(mock_tree.search(search))
+        assert [tree.intervals[h] for h in
+                indices[1][offsets[k]:offsets[k + 1]]] == found
+
+
+@pytest.mark.frozen_itree
+def test_frozen_read_only_queries(FakeNode, itree_random_intervals,
+                                  itree_random_queries):
+    tree = itree.FrozenITree(itree_random_intervals)
+    reference = itree.ITree.from_intervals(itree_random_intervals)
+    starts = [q.start for q in itree_random_queries]
+    ends = [q.end for q in itree_random_queries]
+
+    for search in itree_random_queries:
+        assert tree.count(search) == reference.count(search)
+        assert tree.overlaps(search) == reference.overlaps(search)
+        assert sorted(tree.iter_search(search)) == \
+            sorted(reference.search(search))
+        ordered = list(tree.iter_search(search, ordered=True))
+        assert [n.start for n in ordered] == \
+            sorted(n.start for n in reference.search(search))
+        assert sorted(ordered) == sorted(reference.search(search))
+        assert len(list(tree.iter_search(search, limit=2))) == \
+            min(2, reference.count(search))
+    assert list(tree.count_many(starts, ends)) == \
+        list(reference.count_many(starts, ends))
+    assert tree.overlaps_many(starts, ends) == \
+        reference.overlaps_many(starts, ends)
+
+    queries = sorted(itree_random_queries, key=lambda q: q.start)
+    assert [sorted(r) for r in tree.search_sorted(queries)] == \
+        [sorted(r) for r in reference.search_sorted(queries)]
+    other = itree.FrozenITree(itree_random_queries)
+    assert sorted(tree.join(other)) == sorted(reference.join(other))
+
+    assert all(n in tree for n in itree_random_intervals[:50])
+    assert FakeNode(-5, -1) not in tree
+    assert not itree.FrozenITree().overlaps(FakeNode(1, 2))
+    assert itree.FrozenITree().count(FakeNode(1, 2)) == 0
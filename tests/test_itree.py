@@ -1,6 +1,10 @@
+import collections
 import operator
+import os
+import pickle
 import random
 import sys
+import threading
 
 import pytest
 import itree
@@ -57,6 +61,99 @@ def test_remove_all_nodes(itree_random_intervals):
     assert len(t) == 0
 
 
+def assert_tree_invariants(tree):
+    """check the AVL balance and the limits augmentation of every node"""
+    def check(n):
+        if n is None:
+            return 0
+        left_height, right_height = check(n.left), check(n.right)
+        children = [c for c in (n.left, n.right) if c is not None]
+        assert abs(left_height - right_height) <= 1
+        assert n.height == 1 + max(left_height, right_height)
+        assert n.min == min([n.start] + [c.min for c in children])
+        assert n.max == max([n.end] + [c.max for c in children])
+        assert n.min_end == min([n.end] + [c.min_end for c in children])
+        weight = len(n.i) if tree._buckets else 1
+        assert n.size == weight + sum(c.size for c in children)
+        if n.left is not None:
+            assert (n.left.start, n.left.end) <= (n.start, n.end)
+        if n.right is not None:
+            assert (n.right.start, n.right.end) >= (n.start, n.end)
+        return n.height
+
+    check(tree.root)
+
+
+@pytest.mark.itree
+def test_mutation_invariants(itree_random_intervals):
+    t = itree.ITree()
+    for node in itree_random_intervals:
+        t.insert(node)
+    assert_tree_invariants(t)
+
+    for node in itree_random_intervals[::3]:
+        t.remove(node)
+    assert_tree_invariants(t)
+    assert len(t) == len(itree_random_intervals) - \
+        len(itree_random_intervals[::3])
+
+
+@pytest.mark.itree
+def test_remove_single_duplicate(FakeNode):
+    t = itree.ITree(nodes=[FakeNode(5, 10) for _ in range(20)])
+
+    for remaining in range(19, -1, -1):
+        t.remove(FakeNode(5, 10))
+        assert len(t) == remaining
+        assert_tree_invariants(t)
+
+
+@pytest.mark.itree
+def test_sorted_insert_stays_shallow(FakeNode):
+    t = itree.ITree(nodes=[FakeNode(k, k + 10) for k in range(5000)])
+
+    assert len(t) == 5000
+    assert t.root.height <= 1.45 * (5000).bit_length()
+    assert_tree_invariants(t)
+
+
+@pytest.mark.itree
+def test_select(itree_complex_sample):
+    t = itree.ITree(nodes=itree_complex_sample)
+    starts = sorted(n.start for n in itree_complex_sample)
+
+    assert [t.select(k).start for k in range(len(t))] == starts
+    assert t.select(-1).start == starts[-1]
+    with pytest.raises(IndexError):
+        t.select(len(t))
+    with pytest.raises(IndexError):
+        itree.ITree().select(0)
+
+
+@pytest.mark.itree
+def test_rank(itree_random_intervals):
+    t = itree.ITree(nodes=itree_random_intervals)
+    starts = [n.start for n in itree_random_intervals]
+
+    for node in itree_random_intervals[::10]:
+        for position in (node.start, node.start + 1, node.end):
+            assert t.rank(position) == sum(s < position for s in starts)
+    assert t.rank(-1) == 0
+    assert itree.ITree().rank(10) == 0
+
+
+@pytest.mark.itree
+def test_select_after_mutation(itree_random_intervals):
+    t = itree.ITree.from_intervals(itree_random_intervals)
+    for node in itree_random_intervals[::2]:
+        t.remove(node)
+    remaining = sorted(n.start for n in itree_random_intervals[1::2])
+
+    assert len(t) == len(remaining)
+    assert [t.select(k).start for k in range(len(t))] == remaining
+    assert_tree_invariants(t)
+
+
 @pytest.mark.itree
 def test_node_really_removed(itree_complex_sample):
     t = itree.ITree()
@@ -94,6 +191,701 @@ def test_genes(FakeITree, gene_intervals):
             assert len(mock_tree.search(search)) == len(tree.search(search))
 
 
+@pytest.mark.itree
+@pytest.mark.parametrize("presorted", [False, True])
+def test_from_intervals(FakeITree, itree_random_intervals, itree_random_queries,
+                        presorted):
+    nodes = itree_random_intervals
+    if presorted:
+        nodes = sorted(nodes, key=lambda n: (n.start, n.end))
+    tree = itree.ITree.from_intervals(nodes, presorted=presorted)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+
+    assert len(tree) == len(mock_tree)
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(mock_tree.search(search))
+    # finding intervals relies on the order by start and end
+    assert all(n in tree for n in nodes)
+    for n in nodes:
+        tree.remove(n)
+    assert len(tree) == 0
+
+
+@pytest.mark.itree
+def test_from_intervals_presorted_by_start_only(FakeNode):
+    nodes = [FakeNode(5, end) for end in [30, 20, 10, 40, 1000, 7, 50]]
+
+    with pytest.raises(ValueError):
+        itree.ITree.from_intervals(nodes, presorted=True)
+    tree = itree.ITree.from_intervals(
+        sorted(nodes, key=lambda n: (n.start, n.end)), presorted=True)
+    assert all(n in tree for n in nodes)
+
+
+@pytest.mark.itree
+def test_from_intervals_balanced(itree_random_intervals):
+    tree = itree.ITree.from_intervals(itree_random_intervals)
+
+    assert tree.root.height == len(itree_random_intervals).bit_length()
+    assert tree.root.min == min(n.start for n in itree_random_intervals)
+    assert tree.root.max == max(n.end for n in itree_random_intervals)
+
+
+@pytest.mark.itree
+def test_from_intervals_then_mutate(FakeITree, itree_complex_sample):
+    tree = itree.ITree.from_intervals(itree_complex_sample[::2])
+    mock_tree = FakeITree(nodes=list(itree_complex_sample[::2]))
+    for node in itree_complex_sample[1::2]:
+        tree.insert(node)
+        mock_tree.insert(node)
+    for node in itree_complex_sample[::4]:
+        tree.remove(node)
+        mock_tree.nodes.remove(node)
+
+    assert len(tree) == len(mock_tree)
+    for search in itree_complex_sample:
+        assert len(tree.search(search)) == len(mock_tree.search(search))
+
+
+@pytest.mark.itree
+def test_from_intervals_empty():
+    tree = itree.ITree.from_intervals([])
+
+    assert tree.root is None
+    assert len(tree) == 0
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("rebuild", [False, True, None])
+@pytest.mark.parametrize("buckets", [False, True])
+def test_insert_remove_many(FakeITree, FakeNode, itree_complex_sample,
+                            rebuild, buckets):
+    tree = itree.ITree.from_intervals(itree_complex_sample[::2],
+                                      buckets=buckets)
+    if rebuild is not None:
+        tree._rebuild_is_cheaper = lambda k: rebuild
+    mock_tree = FakeITree(nodes=list(itree_complex_sample[::2]))
+
+    tree.insert_many(itree_complex_sample[1::2])
+    mock_tree.nodes.extend(itree_complex_sample[1::2])
+    assert_tree_invariants(tree)
+
+    removed = itree_complex_sample[::3] + [FakeNode(-5, -1)]
+    assert tree.remove_many(removed) == len(removed) - 1
+    for node in removed[:-1]:
+        mock_tree.nodes.remove(node)
+    assert_tree_invariants(tree)
+
+    assert len(tree) == len(mock_tree)
+    assert sorted(tree) == sorted(mock_tree.nodes)
+    for search in itree_complex_sample:
+        assert sorted(tree.search(search)) == \
+            sorted(mock_tree.search(search))
+
+
+@pytest.mark.itree
+def test_insert_remove_many_empty(FakeNode):
+    tree = itree.ITree()
+    tree.insert_many([])
+    assert tree.remove_many([FakeNode(1, 2)]) == 0
+
+    tree.insert_many([FakeNode(1, 2)])
+    assert list(tree) == [FakeNode(1, 2)]
+    assert tree.remove_many([FakeNode(1, 2), FakeNode(1, 2)]) == 1
+    assert len(tree) == 0
+
+
+@pytest.mark.itree
+def test_rebuild_for_large_batches(itree_random_intervals):
+    tree = itree.ITree.from_intervals(itree_random_intervals)
+
+    assert not tree._rebuild_is_cheaper(1)
+    assert tree._rebuild_is_cheaper(len(tree))
+
+
+@pytest.mark.itree
+def test_buckets(FakeITree, itree_complex_sample):
+    tree = itree.ITree(nodes=itree_complex_sample, buckets=True)
+    bulk_tree = itree.ITree.from_intervals(itree_complex_sample, buckets=True)
+    mock_tree = FakeITree(nodes=list(itree_complex_sample))
+    distinct = len(set(itree_complex_sample))
+
+    for t in [tree, bulk_tree]:
+        assert_tree_invariants(t)
+        assert len(t) == len(itree_complex_sample)
+        assert sum(1 for _ in t._nodes()) == distinct
+        assert sorted(t) == sorted(itree_complex_sample)
+        assert [t.select(k) for k in range(len(t))] == list(t)
+        assert t.rank(37734) == sum(n.start < 37734 for n in mock_tree.nodes)
+        for search in itree_complex_sample:
+            expected = sorted(mock_tree.search(search))
+            assert sorted(t.search(search)) == expected
+            assert sorted(t.iter_search(search)) == expected
+            assert sorted(t.search_point(search.start)) == \
+                sorted(mock_tree.search(type(search)(search.start,
+                                                     search.start)))
+        offsets, hits = t.search_many([s.start for s in itree_complex_sample],
+                                      [s.end for s in itree_complex_sample])
+        assert offsets[-1] == len(hits) == \
+            sum(len(mock_tree.search(s)) for s in itree_complex_sample)
+
+
+@pytest.mark.itree
+def test_buckets_remove(FakeITree, FakeNode, itree_complex_sample):
+    tree = itree.ITree(nodes=itree_complex_sample, buckets=True)
+    mock_tree = FakeITree(nodes=list(itree_complex_sample))
+
+    for node in itree_complex_sample[::2]:
+        tree.remove(node)
+        mock_tree.nodes.remove(node)
+        assert_tree_invariants(tree)
+    assert tree.remove_many(itree_complex_sample[1::4]) == \
+        len(itree_complex_sample[1::4])
+    for node in itree_complex_sample[1::4]:
+        mock_tree.nodes.remove(node)
+    assert_tree_invariants(tree)
+
+    assert sorted(tree) == sorted(mock_tree.nodes)
+    for search in itree_complex_sample:
+        assert sorted(tree.search(search)) == \
+            sorted(mock_tree.search(search))
+
+
+@pytest.mark.itree
+def test_buckets_remove_same_object():
+    Interval = collections.namedtuple('Interval', 'start end name')
+    a, b = Interval(5, 10, 'a'), Interval(5, 10, 'b')
+    tree = itree.ITree(nodes=[a, b], buckets=True)
+
+    tree.remove(a)
+    assert tree.search(a) == [b]
+    tree.insert_many([a, Interval(1, 2, 'c')])
+    assert sorted(tree.search(a)) == [a, b]
+    assert len(tree) == 3
+
+
+@pytest.mark.itree
+def test_search_cache(FakeITree, FakeNode, itree_complex_sample):
+    tree = itree.ITree.from_intervals(itree_complex_sample, cache_size=2)
+    mock_tree = FakeITree(nodes=list(itree_complex_sample))
+    a, b, c = FakeNode(500, 600), FakeNode(40000, 40001), FakeNode(1, 2)
+
+    assert tree.search(a) == tree.search(a)
+    assert tree.cache_info() == (1, 1, 2, 1)
+    tree.search(a).append(None)
+    assert sorted(tree.search(a)) == sorted(mock_tree.search(a))
+
+    # b and c evict a, the least recently used
+    tree.search(b)
+    tree.search(c)
+    tree.search(c)
+    tree.search(a)
+    assert tree.cache_info() == (4, 4, 2, 2)
+
+    d = FakeNode(550, 560)
+    for mutate, present in [(tree.insert, True), (tree.remove, False),
+                            (lambda n: tree.insert_many([n]), True),
+                            (lambda n: tree.remove_many([n]), False)]:
+        mutate(d)
+        expected = mock_tree.search(a) + ([d] if present else [])
+        assert sorted(tree.search(a)) == sorted(expected)
+
+    tree.cache_clear()
+    assert tree.cache_info() == (0, 0, 2, 0)
+    assert itree.ITree().cache_info() is None
+
+
+@pytest.mark.itree
+def test_search_cache_threads(FakeITree, itree_random_intervals,
+                              itree_random_queries):
+    tree = itree.ITree.from_intervals(itree_random_intervals, cache_size=8)
+    mock_tree = FakeITree(nodes=list(itree_random_intervals))
+    queries = itree_random_queries[:16]
+    expected = [sorted(mock_tree.search(q)) for q in queries]
+    errors = []
+
+    def search():
+        try:
+            for _ in range(10):
+                for q, hits in zip(queries, expected):
+                    assert sorted(tree.search(q)) == hits
+        except Exception as e:
+            errors.append(e)
+
+    # switch threads as often as possible to provoke races
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=search) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    info = tree.cache_info()
+    assert info.hits + info.misses == 8 * 10 * len(queries)
+    assert info.currsize == 8
+
+
+@pytest.mark.itree
+def test_stats_search(FakeITree, FakeNode, itree_complex_sample):
+    tree = itree.ITree.from_intervals(itree_complex_sample)
+    mock_tree = FakeITree(nodes=list(itree_complex_sample))
+    stats = tree.enable_stats()
+
+    for search in itree_complex_sample:
+        assert sorted(tree.search(search)) == \
+            sorted(mock_tree.search(search))
+    assert tree.stats is stats
+    assert stats.searches == len(itree_complex_sample)
+    assert stats.hits == sum(len(mock_tree.search(search))
+                             for search in itree_complex_sample)
+    assert stats.hits <= stats.visited
+    assert 0 < stats.max_stack <= tree.root.height
+
+    # a query past the end of every interval only visits the root
+    tree.enable_stats()
+    assert tree.search(FakeNode(10 ** 6, 10 ** 6)) == []
+    assert (tree.stats.visited, tree.stats.pruned_max,
+            tree.stats.pruned_min) == (1, 2, 0)
+    assert tree.search(FakeNode(-2, -1)) == []
+    assert (tree.stats.visited, tree.stats.pruned_max,
+            tree.stats.pruned_min) == (2, 2, 2)
+
+    tree.disable_stats()
+    tree.search(FakeNode(-2, -1))
+    assert tree.stats is None
+    assert stats.searches == len(itree_complex_sample)
+
+
+@pytest.mark.itree
+def test_stats_mutations(FakeNode):
+    tree = itree.ITree()
+    stats = tree.enable_stats()
+    for k in range(100):
+        tree.insert(FakeNode(k, k + 1))
+    tree.remove(FakeNode(5, 6))
+    tree.discard(FakeNode(5, 6))
+    tree._rebuild_is_cheaper = lambda k: True
+    tree.remove_many([FakeNode(7, 8)])
+
+    assert (stats.inserts, stats.removes, stats.rebuilds) == (100, 1, 1)
+    assert stats.rotations > 0
+    assert_tree_invariants(tree)
+    assert stats + stats == itree.TreeStats() + stats + stats
+
+
+@pytest.mark.itree
+def test_stats_pickle(FakeNode, itree_simple_sample):
+    tree = itree.ITree.from_intervals(itree_simple_sample, cache_size=4)
+    tree.enable_stats()
+    tree.search(FakeNode(1, 6))
+    copy = pickle.loads(pickle.dumps(tree))
+
+    assert copy.stats.searches == 1
+    copy.insert(FakeNode(2, 4))
+    copy.search(FakeNode(1, 6))
+    assert (copy.stats.searches, copy.stats.inserts) == (2, 1)
+    assert tree.stats.searches == 1
+    copy.disable_stats()
+    assert pickle.loads(pickle.dumps(copy)).stats is None
+
+
+def node_states(tree):
+    # every attribute of every node, to detect modifications
+    return [(id(n), n.i if not isinstance(n.i, list) else list(n.i), n.start,
+             n.end, n.left, n.right, n.min, n.max, n.height, n.size)
+            for n in tree._nodes()]
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("buckets", [False, True])
+def test_snapshot_isolation(FakeITree, itree_complex_sample, buckets):
+    tree = itree.ITree(nodes=itree_complex_sample[::2], buckets=buckets)
+    snapshot = tree.snapshot()
+    states = node_states(snapshot)
+    mock_tree = FakeITree(nodes=list(itree_complex_sample[::2]))
+
+    for node in itree_complex_sample[1::2]:
+        tree.insert(node)
+        mock_tree.insert(node)
+    for node in itree_complex_sample[::3]:
+        tree.remove(node)
+        mock_tree.nodes.remove(node)
+    tree._rebuild_is_cheaper = lambda k: True
+    tree.insert_many(itree_complex_sample[:10])
+    mock_tree.nodes.extend(itree_complex_sample[:10])
+    tree.remove_many(itree_complex_sample[:20])
+    for node in itree_complex_sample[:20]:
+        if node in mock_tree.nodes:
+            mock_tree.nodes.remove(node)
+
+    assert node_states(snapshot) == states
+    assert_tree_invariants(snapshot)
+    assert_tree_invariants(tree)
+    assert sorted(snapshot) == sorted(itree_complex_sample[::2])
+    assert sorted(tree) == sorted(mock_tree.nodes)
+
+
+@pytest.mark.itree
+def test_snapshot_mutation(itree_random_intervals):
+    tree = itree.ITree.from_intervals(itree_random_intervals)
+    snapshot = tree.snapshot()
+    for node in itree_random_intervals[::2]:
+        snapshot.remove(node)
+        tree.insert(node)
+
+    assert_tree_invariants(tree)
+    assert_tree_invariants(snapshot)
+    assert len(tree) == 1.5 * len(itree_random_intervals)
+    assert len(snapshot) == 0.5 * len(itree_random_intervals)
+    assert sorted(tree.snapshot()) == sorted(tree)
+
+
+@pytest.mark.itree
+def test_snapshot_concurrent_readers(itree_random_intervals):
+    tree = itree.ITree(persistent=True)
+    done = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            while not done.is_set():
+                snapshot = tree.snapshot()
+                assert_tree_invariants(snapshot)
+                assert len(list(snapshot)) == len(snapshot)
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    for node in itree_random_intervals:
+        tree.insert(node)
+    for node in itree_random_intervals[::2]:
+        tree.remove(node)
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
+    assert len(tree) == len(itree_random_intervals) // 2
+
+
+@pytest.mark.itree
+def test_itree_iter(itree_random_intervals):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    starts = [n.start for n in tree]
+
+    assert len(starts) == len(itree_random_intervals)
+    assert starts == sorted(starts)
+
+
+@pytest.mark.itree
+def test_search_many(FakeITree, itree_random_intervals, itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+    offsets, hits = tree.search_many([q.start for q in itree_random_queries],
+                                     [q.end for q in itree_random_queries])
+
+    assert len(offsets) == len(itree_random_queries) + 1
+    for k, search in enumerate(itree_random_queries):
+        assert sorted(hits[offsets[k]:offsets[k + 1]]) == \
+            sorted(mock_tree.search(search))
+
+
+@pytest.mark.itree
+def test_search_many_numpy(itree_random_intervals, itree_random_queries):
+    np = pytest.importorskip('numpy')
+    tree = itree.ITree(nodes=itree_random_intervals)
+    offsets, hits = tree.search_many(
+        np.array([q.start for q in itree_random_queries]),
+        np.array([q.end for q in itree_random_queries]))
+
+    for k, search in enumerate(itree_random_queries):
+        assert hits[offsets[k]:offsets[k + 1]] == tree.search(search)
+
+
+@pytest.mark.itree
+def test_search_many_mismatched_lengths(itree_simple_sample):
+    tree = itree.ITree(nodes=itree_simple_sample)
+    with pytest.raises(ValueError):
+        tree.search_many([1, 2], [3])
+
+
+@pytest.mark.itree
+def test_search_many_empty_tree():
+    offsets, hits = itree.ITree().search_many([1, 5], [3, 8])
+
+    assert list(offsets) == [0, 0, 0]
+    assert hits == []
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("threads", [2, 3, 64])
+def test_search_many_threads(itree_random_intervals, itree_random_queries,
+                             threads):
+    tree = itree.ITree(nodes=itree_random_intervals, buckets=threads == 3)
+    starts = [q.start for q in itree_random_queries]
+    ends = [q.end for q in itree_random_queries]
+
+    assert tree.search_many(starts, ends, threads=threads) == \
+        tree.search_many(starts, ends)
+    assert itree.ITree().search_many([1, 5], [3, 8], threads=threads) == \
+        itree.ITree().search_many([1, 5], [3, 8])
+
+
+@pytest.mark.itree
+def test_search_many_blocks_writers(itree_random_intervals,
+                                    itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    starts = [q.start for q in itree_random_queries]
+    ends = [q.end for q in itree_random_queries]
+    expected = tree.search_many(starts, ends)
+
+    with tree._lock.reading():
+        writer = threading.Thread(
+            target=tree.remove_many, args=(itree_random_intervals,))
+        writer.start()
+        writer.join(0.1)
+        assert writer.is_alive()
+        # readers are not held up by the waiting writer
+        assert tree.search_many(starts, ends, threads=2) == expected
+    writer.join()
+
+    assert len(tree) == 0
+
+
+@pytest.mark.itree
+def test_count(FakeITree, itree_random_intervals, itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+
+    for search in itree_random_queries:
+        assert tree.count(search) == len(mock_tree.search(search))
+    assert list(tree.count_many([q.start for q in itree_random_queries],
+                                [q.end for q in itree_random_queries])) == \
+        [len(mock_tree.search(q)) for q in itree_random_queries]
+
+
+@pytest.mark.itree
+def test_count_after_mutation(FakeNode, itree_simple_sample):
+    tree = itree.ITree(nodes=itree_simple_sample)
+    query = FakeNode(16, 20)
+    assert tree.count(query) == len(tree.search(query))
+
+    tree.insert(FakeNode(18, 18))
+    assert tree.count(query) == len(tree.search(query))
+
+    tree.remove(FakeNode(16, 21))
+    assert tree.count(query) == len(tree.search(query))
+
+
+@pytest.mark.itree
+def test_count_empty_tree(FakeNode):
+    assert itree.ITree().count(FakeNode(3, 15)) == 0
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("ordered", [False, True])
+def test_iter_search(FakeITree, itree_random_intervals, itree_random_queries,
+                     ordered):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+
+    for search in itree_random_queries:
+        hits = list(tree.iter_search(search, ordered=ordered))
+        assert sorted(hits) == sorted(mock_tree.search(search))
+        if ordered:
+            assert [h.start for h in hits] == sorted(h.start for h in hits)
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("ordered", [False, True])
+def test_iter_search_limit(FakeNode, itree_complex_sample, ordered):
+    tree = itree.ITree(nodes=itree_complex_sample)
+    query = FakeNode(50000, 100000)
+    expected = tree.search(query)
+
+    hits = list(tree.iter_search(query, limit=3, ordered=ordered))
+    assert len(hits) == 3
+    assert all(h in expected for h in hits)
+    if ordered:
+        assert [h.start for h in hits] == \
+            sorted(h.start for h in expected)[:3]
+    assert list(tree.iter_search(query, limit=0)) == []
+    assert list(itree.ITree().iter_search(query)) == []
+
+
+@pytest.mark.itree
+def test_overlaps(FakeITree, FakeNode, itree_random_intervals,
+                  itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+    queries = itree_random_queries + [FakeNode(30000, 40000)]
+    expected = [bool(mock_tree.search(q)) for q in queries]
+
+    assert [tree.overlaps(q) for q in queries] == expected
+    assert tree.overlaps_many([q.start for q in queries],
+                              [q.end for q in queries]) == expected
+    assert not itree.ITree().overlaps(queries[0])
+
+
+@pytest.mark.itree
+def test_search_point(FakeITree, FakeNode, itree_random_intervals,
+                      itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+    positions = [q.start for q in itree_random_queries] + \
+        [n.end for n in itree_random_intervals[:50]] + [-1, 10 ** 6]
+
+    for pos in positions:
+        assert sorted(tree.search_point(pos)) == \
+            sorted(mock_tree.search(FakeNode(pos, pos)))
+
+    offsets, hits = tree.search_points(positions)
+    assert len(offsets) == len(positions) + 1
+    for k, pos in enumerate(positions):
+        assert hits[offsets[k]:offsets[k + 1]] == tree.search_point(pos)
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("buckets", [False, True])
+def test_search_within_enclosing(FakeNode, itree_random_intervals,
+                                 itree_random_queries, buckets):
+    tree = itree.ITree(buckets=buckets)
+    for node in itree_random_intervals:
+        tree.insert(node)
+    for node in itree_random_intervals[::3]:
+        tree.remove(node)
+    live = [n for k, n in enumerate(itree_random_intervals) if k % 3]
+    queries = itree_random_queries + [FakeNode(q.start, q.start + 5000)
+                                      for q in itree_random_queries]
+    assert_tree_invariants(tree)
+
+    for q in queries:
+        assert sorted(tree.search_within(q)) == sorted(
+            n for n in live if q.start <= n.start and n.end <= q.end)
+        assert sorted(tree.search_enclosing(q)) == sorted(
+            n for n in live if n.start <= q.start and q.end <= n.end)
+    assert itree.ITree().search_within(queries[0]) == []
+    assert itree.ITree().search_enclosing(queries[0]) == []
+
+
+@pytest.mark.itree
+def test_search_point_empty_tree():
+    offsets, hits = itree.ITree().search_points([1, 2])
+
+    assert itree.ITree().search_point(1) == []
+    assert list(offsets) == [0, 0, 0]
+    assert hits == []
+
+
+@pytest.mark.itree
+def test_join(FakeITree, itree_random_intervals, itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    other = itree.ITree(nodes=itree_random_queries)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+    expected = sorted((a, b) for b in itree_random_queries
+                      for a in mock_tree.search(b))
+
+    assert sorted(tree.join(other)) == expected
+    assert sorted(tree.join(itree.FrozenITree(other))) == expected
+    assert sorted((b, a) for a, b in other.join(tree)) == expected
+
+
+@pytest.mark.itree
+def test_join_duplicates(FakeITree, itree_complex_sample):
+    tree = itree.ITree(nodes=itree_complex_sample)
+    mock_tree = FakeITree(nodes=itree_complex_sample)
+    expected = sorted((a, b) for b in itree_complex_sample
+                      for a in mock_tree.search(b))
+
+    assert sorted(tree.join(tree)) == expected
+    assert list(tree.join(itree.ITree())) == []
+    assert list(itree.ITree().join(tree)) == []
+
+
+@pytest.mark.itree
+def test_search_sorted(FakeITree, itree_random_intervals, itree_random_queries):
+    tree = itree.ITree(nodes=itree_random_intervals)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+    queries = sorted(itree_random_queries, key=lambda q: q.start)
+
+    results = list(tree.search_sorted(queries))
+    assert len(results) == len(queries)
+    for search, result in zip(queries, results):
+        assert sorted(result) == sorted(mock_tree.search(search))
+
+
+@pytest.mark.itree
+def test_search_sorted_nested_queries(FakeNode, itree_complex_sample):
+    tree = itree.ITree(nodes=itree_complex_sample)
+    # a wide query followed by narrower ones starting later
+    queries = [FakeNode(500, 120000), FakeNode(600, 700),
+               FakeNode(50000, 50001), FakeNode(50000, 50000),
+               FakeNode(300000, 300001)]
+
+    for search, result in zip(queries, tree.search_sorted(queries)):
+        assert sorted(result) == sorted(tree.search(search))
+
+
+class CountingInterval(object):
+    # an interval counting the reads of its coordinates
+    reads = 0
+
+    def __init__(self, start, end):
+        self._start, self._end = start, end
+
+    @property
+    def start(self):
+        CountingInterval.reads += 1
+        return self._start
+
+    @property
+    def end(self):
+        CountingInterval.reads += 1
+        return self._end
+
+
+@pytest.mark.itree
+@pytest.mark.parametrize("frozen", [False, True])
+def test_search_sorted_work(FakeNode, frozen):
+    intervals = [CountingInterval(k * 10, k * 10 + 25) for k in range(5000)]
+    tree = itree.ITree.from_intervals(intervals)
+    if frozen:
+        tree = itree.FrozenITree(tree)
+    else:
+        stats = tree.enable_stats()
+    # a wide query followed by many narrow ones, first dense then sparse
+    queries = [FakeNode(0, 50000)] + \
+        [FakeNode(k, k + 5) for k in range(0, 5000, 5)] + \
+        [FakeNode(k, k) for k in range(5000, 50000, 97)]
+
+    CountingInterval.reads = 0
+    results = list(tree.search_sorted(queries))
+    reads = CountingInterval.reads
+    hits = sum(len(result) for result in results)
+    for search, result in zip(queries, results):
+        assert sorted(result, key=id) == sorted(tree.search(search), key=id)
+    # a few reads per interval passed and per hit, rather than rescanning
+    # the intervals of the wide query for every later query
+    assert reads <= 8 * (hits + len(queries))
+    if not frozen:
+        assert stats.visited <= 4 * len(queries) * len(tree).bit_length()
+
+
+@pytest.mark.itree
+def test_search_sorted_unsorted(FakeNode, itree_simple_sample):
+    tree = itree.ITree(nodes=itree_simple_sample)
+    results = tree.search_sorted([FakeNode(10, 20), FakeNode(5, 6)])
+
+    assert sorted(next(results)) == sorted(tree.search(FakeNode(10, 20)))
+    with pytest.raises(ValueError):
+        next(results)
+
 simple_tree_pstring = '''\
           ┌–(0,3)
      ┌–(5,8)
@@ -121,6 +913,15 @@ def test_node_str(itree_simple_sample):
     assert str(node) == f'({node.start},{node.end})'
 
 
+@pytest.mark.itree
+def test_node_slots(itree_simple_sample):
+    node = itree.ITreeNode(itree_simple_sample[0])
+
+    assert not hasattr(node, '__dict__')
+    assert node.left is None and node.right is None
+    assert node.interval is itree_simple_sample[0]
+
+
 @pytest.mark.itree
 def test_node_pstring(itree_simple_sample):
     node = itree.ITreeNode(itree_simple_sample[0])
@@ -146,7 +947,7 @@ def test_remove_nothing(FakeITree, FakeNode, itree_simple_sample):
     assert nonpresent_node not in itree_simple_sample, \
         f"{nonpresent_node} is in the sample; revise the test"
     expected = FakeITree(itree_simple_sample)
-    tree.remove(nonpresent_node)
+    tree.discard(nonpresent_node)
 
     test_node = itree_simple_sample[0]
 
@@ -154,6 +955,37 @@ def test_remove_nothing(FakeITree, FakeNode, itree_simple_sample):
     assert tree.search(test_node) == expected.search(test_node)
 
 
+@pytest.mark.itree
+def test_remove_absent_raises(FakeNode, itree_simple_sample):
+    tree = itree.ITree(nodes=itree_simple_sample)
+    version = tree._version
+    with pytest.raises(KeyError):
+        tree.remove(FakeNode(100000, 200000))
+
+    assert len(tree) == len(itree_simple_sample)
+    assert tree._version == version
+
+
+@pytest.mark.itree
+def test_contains_and_remove_duplicates(FakeNode):
+    # many intervals sharing a start, some with identical coordinates
+    nodes = [FakeNode(5, e) for e in range(6, 40)] + \
+            [FakeNode(5, 20) for _ in range(5)] + \
+            [FakeNode(s, 20) for s in range(5)]
+    random.Random(3).shuffle(nodes)
+    tree = itree.ITree(nodes=nodes)
+
+    assert FakeNode(5, 20) in tree
+    assert FakeNode(5, 41) not in tree
+    assert FakeNode(4, 21) not in tree
+    for node in nodes:
+        assert node in tree
+        tree.remove(node)
+        assert_tree_invariants(tree)
+    assert len(tree) == 0
+    assert FakeNode(5, 20) not in tree
+
+
 @pytest.mark.itree
 def test_search_empty_tree(FakeITree, FakeNode):
     tree = itree.ITree()
@@ -195,7 +1027,7 @@ def test_create_grouped_itree(gene_intervals_short):
 
     assert tree is not None
 
-    expected = "GroupedITree(key=annotation, trees={'Chr10': ITree(root=(613874,621867))})"
+    expected = "GroupedITree(key=annotation, trees={'Chr10': ITree(root=(437567,456998))})"
 
     assert str(tree) == expected
 
@@ -225,6 +1057,118 @@ def test_remove_grouped_itree(FakeGroupedITree, gene_intervals_short):
     assert tree.search(gene_intervals_short[0]) == \
            fake_tree.search(gene_intervals_short[0])
 
+
+@pytest.mark.grouped_itree
+def test_insert_remove_many_grouped_itree(FakeGroupedITree,
+                                          gene_intervals_short):
+    tree = itree.GroupedITree(key="annotation",
+                              intervals=gene_intervals_short[::2])
+    fake_tree = FakeGroupedITree(key="annotation",
+                                 intervals=gene_intervals_short)
+
+    tree.insert_many(gene_intervals_short[1::2])
+    for node in gene_intervals_short:
+        assert sorted(tree.search(node)) == sorted(fake_tree.search(node))
+
+    removed = gene_intervals_short[::3]
+    assert tree.remove_many(removed) == len(removed)
+    for node in removed:
+        fake_tree.trees[node.annotation].nodes.remove(node)
+    for node in gene_intervals_short:
+        assert sorted(tree.search(node)) == sorted(fake_tree.search(node))
+
+
+@pytest.mark.grouped_itree
+def test_grouped_itree_buckets(FakeGroupedITree, gene_intervals_short):
+    tree = itree.GroupedITree(key="annotation",
+                              intervals=gene_intervals_short[::2],
+                              buckets=True)
+    fake_tree = FakeGroupedITree(key="annotation",
+                                 intervals=gene_intervals_short)
+    for node in gene_intervals_short[1::2]:
+        tree.insert(node)
+
+    for t in tree.trees.values():
+        assert_tree_invariants(t)
+    for node in gene_intervals_short:
+        assert sorted(tree.search(node)) == sorted(fake_tree.search(node))
+
+
+@pytest.mark.grouped_itree
+def test_grouped_itree_search_cache(FakeGroupedITree, gene_intervals_short):
+    tree = itree.GroupedITree(key="annotation",
+                              intervals=gene_intervals_short[1:],
+                              cache_size=10)
+    fake_tree = FakeGroupedITree(key="annotation",
+                                 intervals=gene_intervals_short[1:])
+    query = gene_intervals_short[0]
+
+    for _ in range(3):
+        assert sorted(tree.search(query)) == sorted(fake_tree.search(query))
+    assert tree.cache_info() == (2, 1, 10, 1)
+
+    tree.insert(query)
+    assert query in tree.search(query)
+    assert tree.cache_info().misses == 2
+
+
+@pytest.mark.grouped_itree
+def test_grouped_itree_stats(gene_intervals_short, FakeNode):
+    tree = itree.GroupedITree(key="annotation",
+                              intervals=gene_intervals_short)
+    tree.enable_stats()
+    for node in gene_intervals_short:
+        tree.search(node)
+    tree.insert(FakeNode(1, 2, "new key"))
+
+    stats = tree.stats
+    assert set(stats) == set(tree.trees)
+    assert stats["new key"].inserts == 1
+    total = sum(stats.values(), itree.TreeStats())
+    assert total.searches == len(gene_intervals_short)
+    assert total.hits == sum(len(tree.search(node))
+                             for node in gene_intervals_short)
+
+    tree.disable_stats()
+    assert tree.stats == {}
+
+
+@pytest.mark.grouped_itree
+def test_grouped_itree_snapshot(gene_intervals_short):
+    tree = itree.GroupedITree(key="annotation",
+                              intervals=gene_intervals_short)
+    snapshot = tree.snapshot()
+    for node in gene_intervals_short[::2]:
+        tree.remove(node)
+
+    for node in gene_intervals_short:
+        assert node in snapshot
+        assert sorted(snapshot.search(node)) == sorted(
+            n for n in gene_intervals_short
+            if n.annotation == node.annotation and
+            n.start <= node.end and node.start <= n.end)
+
+
+@pytest.mark.grouped_itree
+def test_remove_absent_grouped_itree(gene_intervals_short):
+    tree = itree.GroupedITree(key="annotation",
+                              intervals=gene_intervals_short)
+    first = gene_intervals_short[0]
+    assert first in tree
+
+    for _ in range(gene_intervals_short.count(first)):
+        tree.remove(first)
+    assert first not in tree
+    with pytest.raises(KeyError):
+        tree.remove(first)
+    tree.discard(first)
+
+    missing = type(first)(first.start, first.end, "no such annotation")
+    assert missing not in tree
+    with pytest.raises(KeyError):
+        tree.remove(missing)
+    tree.discard(missing)
+
 @pytest.mark.grouped_itree
 def test_search_grouped_itree_string(FakeGroupedITree, gene_intervals_short):
     tree = itree.GroupedITree(key=lambda node: node.annotation,
@@ -255,6 +1199,165 @@ def test_search_grouped_itree_nonexistent_key(FakeNode, gene_intervals_short):
     assert tree.search(FakeNode(1,2,annotation='IAMNOTANANNOTATION')) == []
 
 
+@pytest.mark.grouped_itree
+def test_count_grouped_itree(FakeGroupedITree, FakeNode, gene_intervals_short):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    fake_tree = FakeGroupedITree(key='annotation',
+                                 intervals=gene_intervals_short)
+    queries = gene_intervals_short[::7] + [FakeNode(1, 2, 'NOTANANNOTATION')]
+    expected = [len(fake_tree.search(q) or []) for q in queries]
+
+    assert [tree.count(q) for q in queries] == expected
+    assert list(tree.count_many(queries)) == expected
+
+
+@pytest.mark.grouped_itree
+def test_overlaps_grouped_itree(FakeGroupedITree, FakeNode,
+                                gene_intervals_short):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    fake_tree = FakeGroupedITree(key='annotation',
+                                 intervals=gene_intervals_short)
+    queries = gene_intervals_short[::7] + [
+        FakeNode(1, 2, 'NOTANANNOTATION'), FakeNode(1, 2, 'Chr10')]
+    expected = [bool(fake_tree.search(q)) for q in queries]
+
+    assert [tree.overlaps(q) for q in queries] == expected
+    assert tree.overlaps_many(queries) == expected
+
+
+@pytest.mark.grouped_itree
+def test_join_grouped_itree(FakeGroupedITree, FakeNode, gene_intervals_short):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    queries = gene_intervals_short[::3] + [FakeNode(1, 2, 'NOTANANNOTATION')]
+    other = itree.GroupedITree(key='annotation', intervals=queries)
+    fake_tree = FakeGroupedITree(key='annotation',
+                                 intervals=gene_intervals_short)
+    expected = sorted((a, b) for b in queries
+                      for a in fake_tree.search(b) or [])
+
+    assert sorted(tree.join(other)) == expected
+
+
+@pytest.mark.grouped_itree
+def test_search_sorted_grouped_itree(FakeNode, gene_intervals_short):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    queries = [FakeNode(1, 2, 'NOTANANNOTATION')] + \
+        sorted(gene_intervals_short, key=lambda q: q.start) + \
+        [FakeNode(3, 4, 'NOTANANNOTATION'), FakeNode(5, 8000, 'Chr10')]
+
+    results = list(tree.search_sorted(queries))
+    assert len(results) == len(queries)
+    for search, result in zip(queries, results):
+        assert sorted(result) == sorted(tree.search(search))
+
 
+@pytest.mark.grouped_itree
+@pytest.mark.parametrize("workers", [None, 2])
+def test_search_many_grouped_itree(FakeGroupedITree, FakeNode,
+                                   gene_intervals_short, workers):
+    intervals = gene_intervals_short + [FakeNode(1, 20, 'Chr1'),
+                                        FakeNode(5, 10, 'Chr1')]
+    tree = itree.GroupedITree(key='annotation', intervals=intervals)
+    fake_tree = FakeGroupedITree(key='annotation', intervals=intervals)
+    queries = intervals + [FakeNode(1, 2, 'NOTANANNOTATION'),
+                           FakeNode(7, 8, 'Chr1')]
+
+    results = tree.search_many(queries, workers=workers)
+    assert len(results) == len(queries)
+    for search, result in zip(queries, results):
+        assert sorted(result) == sorted(fake_tree.search(search) or [])
+
+
+@pytest.mark.grouped_itree
+@pytest.mark.parametrize("loaded", [False, True])
+def test_grouped_itree_search_within_enclosing(tmp_path, FakeNode,
+                                               gene_intervals_short, loaded):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    if loaded:
+        path = str(tmp_path / 'grouped.idx')
+        tree.save(path, payload=False)
+        tree = itree.GroupedITree.load(path)
+    coordinates = collections.Counter(
+        (n.start, n.end) for n in gene_intervals_short
+        if n.annotation == 'Chr10')
+
+    window = FakeNode(200000, 600000, 'Chr10')
+    within = collections.Counter(
+        (n.start, n.end) for n in tree.search_within(window))
+    assert 0 < sum(within.values()) < len(gene_intervals_short)
+    assert within == collections.Counter(
+        {(s, e): c for (s, e), c in coordinates.items()
+         if 200000 <= s and e <= 600000})
+    for start, end in coordinates:
+        position = FakeNode(start, start, 'Chr10')
+        assert sorted((n.start, n.end) for n in
+                      tree.search_enclosing(position)) == sorted(
+            (s, e) for (s, e), c in coordinates.items()
+            for _ in range(c) if s <= start <= e)
+    assert tree.search_within(FakeNode(1, 2, 'NOTANANNOTATION')) == []
+    assert tree.search_enclosing(FakeNode(1, 2, 'NOTANANNOTATION')) == []
+
+
+@pytest.mark.grouped_itree
+@pytest.mark.parametrize("loaded", [False, True])
+def test_search_many_grouped_itree_threads(tmp_path, FakeNode,
+                                           gene_intervals_short, loaded):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    if loaded:
+        path = str(tmp_path / 'grouped.idx')
+        tree.save(path)
+        tree = itree.GroupedITree.load(path)
+    queries = gene_intervals_short + [FakeNode(1, 2, 'NOTANANNOTATION')]
+
+    assert tree.search_many(queries, threads=3) == tree.search_many(queries)
+    with pytest.raises(ValueError):
+        tree.search_many(queries, workers=2, threads=2)
 
 
+@pytest.mark.grouped_itree
+def test_search_many_grouped_itree_after_mutation(FakeNode,
+                                                  gene_intervals_short):
+    tree = itree.GroupedITree(key='annotation', intervals=gene_intervals_short)
+    query = FakeNode(1, 10 ** 6, 'Chr10')
+    assert tree.search_many([query], workers=2) == [tree.search(query)]
+
+    tree.remove(gene_intervals_short[0])
+    tree.insert(FakeNode(3, 4, 'Chr10'))
+    assert sorted(tree.search_many([query], workers=2)[0]) == \
+        sorted(tree.search(query))
+
+
+@pytest.mark.grouped_itree
+def test_search_many_grouped_itree_pool(FakeNode, gene_intervals_short):
+    query = FakeNode(1, 10 ** 6, 'Chr10')
+    with itree.GroupedITree('annotation', gene_intervals_short) as tree:
+        expected = [tree.search(query)]
+        assert tree.search_many([query], workers=2) == expected
+        pool = tree._pool[2]
+        # the workers are kept until the trees change
+        assert tree.search_many([query], workers=2) == expected
+        assert tree._pool[2] is pool
+        assert tree.search_many([query], workers=3) == expected
+        assert tree._pool[2] is not pool
+        pool = tree._pool[2]
+        tree.insert(FakeNode(3, 4, 'Chr10'))
+        assert len(tree.search_many([query], workers=3)[0]) == \
+            len(expected[0]) + 1
+        assert tree._pool[2] is not pool
+        path = tree._shared_index[1]
+    assert tree._pool is None and tree._shared_index is None
+    assert not os.path.exists(path)
+
+
+@pytest.mark.grouped_itree
+@pytest.mark.parametrize("workers", [None, 2])
+def test_search_many_loaded_grouped_itree(tmp_path, gene_intervals_short,
+                                          workers):
+    path = str(tmp_path / 'grouped.idx')
+    itree.GroupedITree('annotation', gene_intervals_short).save(path)
+    tree = itree.GroupedITree.load(path)
+
+    results = tree.search_many(gene_intervals_short, workers=workers)
+    for search, result in zip(gene_intervals_short, results):
+        assert sorted(result) == sorted(tree.search(search))
+    assert tree.search_many([]) == []
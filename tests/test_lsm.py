@@ -0,0 +1,179 @@
+import random
+
+import pytest
+import itree
+
+
+def assert_lsm_invariants(tree):
+    keys = [(i.start, i.end) for i in tree._buffer]
+    assert keys == sorted(keys) == tree._buffer_keys
+    assert len(tree._buffer) < tree.buffer_size
+    assert all(len(level) for level in tree._levels)
+    assert all(tree._tombstones.values())
+    assert tree._dead == sum(len(removed)
+                             for removed in tree._tombstones.values())
+    assert tree._dead < tree.buffer_size
+    if tree._merger is None:
+        assert tree._pick_merge() is None
+
+
+@pytest.mark.lsm_itree
+@pytest.mark.parametrize("background", [False, True])
+def test_lsm_search(itree_random_intervals, itree_random_queries, background):
+    tree = itree.LSMITree(buffer_size=16, size_ratio=2, background=background)
+    reference = itree.ITree()
+    for node in itree_random_intervals:
+        tree.insert(node)
+        reference.insert(node)
+    for node in itree_random_intervals[::3]:
+        tree.remove(node)
+        reference.remove(node)
+
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(reference.search(search))
+    tree.compact()
+    assert len(tree._levels) == 1
+    assert_lsm_invariants(tree)
+    assert len(tree) == len(reference)
+    assert list(tree) == list(reference)
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(reference.search(search))
+
+
+@pytest.mark.lsm_itree
+def test_lsm_interleaved(FakeNode):
+    tree = itree.LSMITree(buffer_size=8)
+    reference = itree.ITree()
+    live = []
+    for step in range(3000):
+        if live and random.random() < 0.3:
+            node = live.pop(random.randrange(len(live)))
+            tree.remove(node)
+            reference.remove(node)
+        else:
+            # few distinct coordinates, so that many intervals share them
+            start = random.randint(0, 200)
+            node = FakeNode(start, start + random.randint(0, 20))
+            live.append(node)
+            tree.insert(node)
+            reference.insert(node)
+        if step % 100 == 0:
+            assert_lsm_invariants(tree)
+            search = FakeNode(step % 200, step % 200 + 10)
+            assert sorted(tree.search(search)) == \
+                sorted(reference.search(search))
+
+    assert len(tree) == len(reference)
+    assert list(tree) == list(reference)
+
+
+@pytest.mark.lsm_itree
+def test_lsm_remove(itree_simple_sample, FakeNode):
+    tree = itree.LSMITree(itree_simple_sample, buffer_size=4)
+    tree.insert(FakeNode(6, 10))
+
+    assert FakeNode(6, 10) in tree
+    tree.remove(FakeNode(6, 10))
+    assert tree._tombstones == {}
+    tree.remove(FakeNode(6, 10))
+    assert tree._tombstones == {(6, 10): [FakeNode(6, 10)]}
+    assert FakeNode(6, 10) not in tree
+    with pytest.raises(KeyError):
+        tree.remove(FakeNode(6, 10))
+    tree.discard(FakeNode(6, 10))
+    assert len(tree) == len(itree_simple_sample) - 1
+
+    for node in itree_simple_sample[2:5]:
+        tree.remove(node)
+    # as many tombstones as the buffer holds clears them all
+    assert tree._tombstones == {}
+    assert len(tree._levels) == 1
+    assert list(tree) == sorted(itree_simple_sample[:1] +
+                                itree_simple_sample[5:])
+
+
+@pytest.mark.lsm_itree
+@pytest.mark.parametrize("background", [False, True])
+def test_lsm_remove_identical(FakeNode, background):
+    a, b, c = (FakeNode(1, 5, name) for name in 'abc')
+    tree = itree.LSMITree([a, b], buffer_size=4, background=background)
+    reference = itree.ITree([a, b], buckets=True)
+
+    # the object itself is removed, whether in a level or in the buffer
+    tree.remove(b)
+    reference.remove(b)
+    assert tree._tombstones == {(1, 5): [b]}
+    assert [x.annotation for x in tree.search(a)] == ['a']
+    assert tree.search(a) == reference.search(a)
+    tree.insert(c)
+    tree.insert(b)
+    tree.remove(c)
+    assert sorted(x.annotation for x in tree.search(a)) == ['a', 'b']
+
+    # results do not change as the levels are merged
+    tree.compact()
+    assert tree._tombstones == {}
+    assert sorted(x.annotation for x in tree.search(a)) == ['a', 'b']
+    tree.remove(a)
+    tree.compact()
+    assert [x.annotation for x in tree.search(a)] == ['b']
+
+
+@pytest.mark.lsm_itree
+def test_lsm_insert_many(itree_random_intervals, itree_random_queries):
+    tree = itree.LSMITree(buffer_size=100)
+    tree.insert_many(itree_random_intervals[:50])
+    assert tree._levels == []
+    tree.insert_many(itree_random_intervals[50:])
+    assert_lsm_invariants(tree)
+
+    reference = itree.ITree.from_intervals(itree_random_intervals)
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(reference.search(search))
+
+
+@pytest.mark.lsm_itree
+def test_lsm_empty(FakeNode):
+    tree = itree.LSMITree()
+
+    assert len(tree) == 0
+    assert tree.search(FakeNode(1, 2)) == []
+    tree.compact()
+    assert tree._levels == []
+    with pytest.raises(ValueError):
+        itree.LSMITree(buffer_size=0)
+
+
+@pytest.mark.lsm_itree
+def test_lsm_close(itree_random_intervals, itree_random_queries):
+    reference = itree.ITree.from_intervals(itree_random_intervals)
+    with itree.LSMITree(buffer_size=16, size_ratio=2,
+                        background=True) as tree:
+        for node in itree_random_intervals[:500]:
+            tree.insert(node)
+    assert tree._merger is None
+    # the levels are merged during insertions once the thread is stopped
+    for node in itree_random_intervals[500:]:
+        tree.insert(node)
+    assert_lsm_invariants(tree)
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(reference.search(search))
+
+
+@pytest.mark.lsm_itree
+def test_lsm_merge_error(itree_random_intervals, monkeypatch):
+    tree = itree.LSMITree(buffer_size=16, size_ratio=2, background=True)
+
+    def fail(*args):
+        raise MemoryError("merge failed")
+
+    monkeypatch.setattr(tree, '_merge_pending', fail)
+    for node in itree_random_intervals[:32]:
+        tree.insert(node)
+    with pytest.raises(MemoryError):
+        tree.compact()
+    # the exception is raised once
+    monkeypatch.undo()
+    tree.compact()
+    tree.close()
+    assert len(tree) == 32
@@ -0,0 +1,117 @@
+import pytest
+import itree
+
+
+@pytest.mark.storage
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_load(tmp_path, FakeITree, itree_random_intervals,
+                   itree_random_queries, mmap):
+    path = str(tmp_path / 'tree.idx')
+    itree.ITree(nodes=itree_random_intervals).save(path)
+    tree = itree.ITree.load(path, mmap=mmap)
+    mock_tree = FakeITree(nodes=itree_random_intervals)
+
+    assert isinstance(tree, itree.FrozenITree)
+    assert len(tree) == len(mock_tree)
+    for search in itree_random_queries:
+        assert sorted(tree.search(search)) == sorted(mock_tree.search(search))
+
+
+@pytest.mark.storage
+def test_save_load_without_payload(tmp_path, itree_complex_sample):
+    path = str(tmp_path / 'tree.idx')
+    frozen = itree.FrozenITree(itree_complex_sample)
+    frozen.save(path, payload=False)
+    tree = itree.FrozenITree.load(path)
+
+    assert list(tree) == [itree.Interval(n.start, n.end) for n in frozen]
+    for search in itree_complex_sample:
+        assert sorted(tree.search(search)) == \
+            sorted((n.start, n.end) for n in frozen.search(search))
+    offsets, hits = tree.search_many([1], [1000])
+    assert sorted(hits) == \
+        sorted(tree.search(itree.Interval(1, 1000)))
+
+
+@pytest.mark.storage
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_load_grouped(tmp_path, FakeGroupedITree, FakeNode,
+                           gene_intervals_short, mmap):
+    path = str(tmp_path / 'grouped.idx')
+    intervals = gene_intervals_short + [FakeNode(1, 20, 'Chr1'),
+                                        FakeNode(5, 10, 'Chr1')]
+    itree.GroupedITree('annotation', intervals).save(path)
+    tree = itree.GroupedITree.load(path, mmap=mmap)
+    fake_tree = FakeGroupedITree(key='annotation', intervals=intervals)
+
+    assert sorted(tree.trees) == ['Chr1', 'Chr10']
+    for search in intervals:
+        assert sorted(tree.search(search)) == sorted(fake_tree.search(search))
+
+
+@pytest.mark.storage
+def test_loaded_grouped_queries(tmp_path, FakeNode, gene_intervals_short):
+    path = str(tmp_path / 'grouped.idx')
+    intervals = gene_intervals_short + [FakeNode(1, 20, 'Chr1'),
+                                        FakeNode(5, 10, 'Chr1')]
+    reference = itree.GroupedITree('annotation', intervals)
+    reference.save(path)
+    tree = itree.GroupedITree.load(path)
+    queries = intervals + [FakeNode(1, 20, 'Chr2')]
+
+    assert list(tree.count_many(queries)) == \
+        list(reference.count_many(queries))
+    assert tree.overlaps_many(queries) == reference.overlaps_many(queries)
+    for search in queries:
+        assert tree.count(search) == reference.count(search)
+        assert tree.overlaps(search) == reference.overlaps(search)
+        assert sorted(tree.iter_search(search)) == \
+            sorted(reference.search(search))
+        assert (search in tree) == (search in reference)
+    assert FakeNode(2, 20, 'Chr1') not in tree
+    ordered = sorted(queries, key=lambda q: (q.annotation, q.start))
+    assert [sorted(r) for r in tree.search_sorted(ordered)] == \
+        [sorted(r) for r in reference.search_sorted(ordered)]
+    assert sorted(tree.join(reference)) == sorted(reference.join(reference))
+
+    # the trees of loaded keys are read-only, but new keys may be added
+    with pytest.raises(TypeError):
+        tree.insert(FakeNode(3, 4, 'Chr1'))
+    with pytest.raises(TypeError):
+        tree.discard(intervals[0])
+    with pytest.raises(TypeError):
+        tree.remove(intervals[0])
+    with pytest.raises(TypeError):
+        tree.remove_many(intervals)
+    tree.insert(FakeNode(3, 4, 'Chr2'))
+    assert tree.search(FakeNode(1, 20, 'Chr2')) == [FakeNode(3, 4, 'Chr2')]
+
+
+@pytest.mark.storage
+def test_load_grouped_requires_key(tmp_path, gene_intervals_short):
+    path = str(tmp_path / 'grouped.idx')
+    itree.GroupedITree(lambda n: n.annotation, gene_intervals_short).save(path)
+
+    with pytest.raises(ValueError):
+        itree.GroupedITree.load(path)
+    with pytest.raises(ValueError):
+        itree.ITree.load(path)
+    tree = itree.GroupedITree.load(path, key='annotation')
+    assert tree.search(gene_intervals_short[0]) != []
+
+
+@pytest.mark.storage
+def test_save_unsupported_keys(tmp_path, gene_intervals_short):
+    tree = itree.GroupedITree(lambda n: (n.annotation,), gene_intervals_short)
+
+    with pytest.raises(TypeError):
+        tree.save(str(tmp_path / 'grouped.idx'))
+
+
+@pytest.mark.storage
+def test_load_not_an_index(tmp_path):
+    path = tmp_path / 'tree.idx'
+    path.write_bytes(b'not an index file at all')
+
+    with pytest.raises(ValueError):
+        itree.ITree.load(str(path))